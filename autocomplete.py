@@ -0,0 +1,128 @@
+import bisect
+import heapq
+from collections import Counter
+
+# Discord accepts at most 25 choices of up to 100 characters each
+MAX_CHOICES = 25
+CHOICE_LIMIT = 100
+# Bigram similarity a key needs to be offered as a typo match
+MIN_SIMILARITY = 0.4
+# Keys looked at per prefix lookup, so a one-letter query stays cheap on a large roster
+PREFIX_SCAN = 200
+
+
+def normalize(text):
+    return ''.join(str(text).casefold().lstrip('#').split())
+
+
+def _grams(key):
+    padded = f" {key}"
+    return {padded[index:index + 2] for index in range(len(padded) - 1)}
+
+
+class SearchIndex:
+    """Autocomplete over labelled values, answered from memory.
+
+    Each value (e.g. a tag) has a display label and a few search keys. Keys
+    sit in a sorted list for bisect prefix lookups and in bigram postings for
+    typo-tolerant matches; both are updated in place as values are set and
+    discarded, so a roster change never means a rebuild.
+    """
+
+    def __init__(self):
+        self._labels = {}
+        self._keys = {}
+        self._sorted = []
+        # key -> values it belongs to
+        self._owners = {}
+        # bigram -> keys containing it
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, value):
+        return value in self._labels
+
+    def set(self, value, label, keys):
+        self._add(value, label, keys, bisect.insort)
+
+    def extend(self, entries):
+        """Bulk `set` for `(value, label, keys)` entries, sorting the keys once at the end."""
+        for value, label, keys in entries:
+            self._add(value, label, keys, list.append)
+        self._sorted.sort()
+
+    def _add(self, value, label, keys, insert):
+        label = label[:CHOICE_LIMIT]
+        keys = {normalize(key) for key in keys} - {''}
+        if self._labels.get(value) == label and self._keys.get(value) == keys:
+            return
+        self.discard(value)
+        self._labels[value] = label
+        self._keys[value] = keys
+        for key in keys:
+            owners = self._owners.get(key)
+            if owners is None:
+                owners = self._owners[key] = set()
+                insert(self._sorted, key)
+                for gram in _grams(key):
+                    self._postings.setdefault(gram, set()).add(key)
+            owners.add(value)
+
+    def discard(self, value):
+        keys = self._keys.pop(value, None)
+        if keys is None:
+            return
+        del self._labels[value]
+        for key in keys:
+            owners = self._owners[key]
+            owners.discard(value)
+            if owners:
+                continue
+            del self._owners[key]
+            del self._sorted[bisect.bisect_left(self._sorted, key)]
+            for gram in _grams(key):
+                postings = self._postings[gram]
+                postings.discard(key)
+                if not postings:
+                    del self._postings[gram]
+
+    def search(self, query, limit=MAX_CHOICES, prefer=()):
+        """`[(label, value)]` best first: exact and prefix matches, then typo matches by bigram similarity.
+
+        Values in `prefer` (e.g. the caller's own accounts) rank ahead of
+        equally close matches, and are what an empty query returns first.
+        """
+        query = normalize(query)
+        prefer = set(prefer)
+        ranks = {}
+
+        def offer(key, tier, similarity):
+            for value in self._owners[key]:
+                rank = (tier, -round(similarity, 2), value not in prefer, self._labels[value])
+                if value not in ranks or rank < ranks[value]:
+                    ranks[value] = rank
+
+        if not query:
+            for value in prefer & self._labels.keys():
+                ranks[value] = (0, 0.0, False, self._labels[value])
+            for key in self._sorted[:limit]:
+                offer(key, 1, 0.0)
+        else:
+            start = bisect.bisect_left(self._sorted, query)
+            for key in self._sorted[start:start + PREFIX_SCAN]:
+                if not key.startswith(query):
+                    break
+                offer(key, 0, len(query) / len(key))
+            if len(ranks) < limit and len(query) > 1:
+                grams = _grams(query)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._postings.get(gram, ()))
+                for key, count in shared.items():
+                    similarity = 2 * count / (len(grams) + len(key))
+                    if similarity >= MIN_SIMILARITY:
+                        offer(key, 1, similarity)
+        best = heapq.nsmallest(limit, ranks.items(), key=lambda item: item[1])
+        return [(self._labels[value], value) for value, _ in best]
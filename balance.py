@@ -0,0 +1,203 @@
+import time
+
+import numpy as np
+
+# Strength a clan's lineup should average to hold its war league
+LEAGUE_TARGETS = {
+    'Champion League I': 17.5,
+    'Champion League II': 17.0,
+    'Champion League III': 16.5,
+    'Master League I': 16.0,
+    'Master League II': 15.5,
+    'Master League III': 15.0,
+    'Crystal League I': 14.5,
+    'Crystal League II': 14.0,
+    'Crystal League III': 13.5,
+    'Gold League I': 13.0,
+    'Gold League II': 12.5,
+    'Gold League III': 12.0,
+    'Silver League I': 11.5,
+    'Silver League II': 11.0,
+    'Silver League III': 10.5,
+    'Bronze League I': 10.0,
+    'Bronze League II': 9.5,
+    'Bronze League III': 9.0,
+    'Unranked': 9.0,
+}
+
+
+class BalanceMember:
+    __slots__ = ('tag', 'name', 'owner', 'town_hall', 'strength', 'pin')
+
+    def __init__(self, tag, name, owner, town_hall, strength, pin=None):
+        self.tag = tag
+        self.name = name
+        self.owner = owner
+        self.town_hall = town_hall
+        self.strength = strength
+        self.pin = pin
+
+
+class ClanTarget:
+    __slots__ = ('tag', 'name', 'size', 'target')
+
+    def __init__(self, tag, name, size, target):
+        self.tag = tag
+        self.name = name
+        self.size = size
+        self.target = target
+
+
+class BalanceResult:
+    __slots__ = ('clans', 'lineups', 'bench', 'overflow', 'cost', 'passes', 'elapsed')
+
+    def __init__(self, clans, lineups, bench, overflow, cost, passes, elapsed):
+        self.clans = clans
+        self.lineups = lineups
+        self.bench = bench
+        # Pinned members that were benched because their clan was full or the owner cap was hit
+        self.overflow = overflow
+        self.cost = cost
+        self.passes = passes
+        self.elapsed = elapsed
+
+
+def _clan_cost(sum_strength, sum_th, count, target, th_weight):
+    # Squared distance of the lineup's mean strength and mean TH from the league target;
+    # strength runs from TH to TH + 1, so TH is shifted by half a point to compare
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = (sum_strength / count - target) ** 2 + th_weight * (sum_th / count + 0.5 - target) ** 2
+    return np.where(count > 0, cost, 0.0)
+
+
+def solve(strength, town_hall, owner, pins, sizes, targets, max_per_owner=1, th_weight=0.5, time_limit=0.8, max_passes=100):
+    """Assign accounts to clans, returning an array of clan indexes (len(sizes) means benched).
+
+    `pins` maps account index to clan index. Pinned accounts are placed first,
+    strongest first; a pin the clan has no room for, or that would break the
+    owner cap, is benched and stays there. The rest are placed greedily from strongest down into the clan whose cost rises least,
+    then pairwise swaps between clans and the bench are applied while any swap
+    lowers the total cost. Each swap candidate set is scored in one vectorised
+    pass. `max_per_owner` caps how many accounts of one Discord member a clan
+    may hold (one main per clan when 1); None disables the cap.
+    """
+    started = time.perf_counter()
+    n, k = len(strength), len(sizes)
+    bench = k
+    owner_ids, owner = np.unique(owner, return_inverse=True)
+    strength = np.asarray(strength, dtype=float)
+    town_hall = np.asarray(town_hall, dtype=float)
+    targets = np.append(np.asarray(targets, dtype=float), 0.0)
+    capacity = np.append(np.asarray(sizes), n)
+    is_clan = np.arange(k + 1) < k
+    limit = max_per_owner or n
+
+    assign = np.full(n, bench)
+    sum_strength = np.zeros(k + 1)
+    sum_th = np.zeros(k + 1)
+    count = np.zeros(k + 1)
+    owner_count = np.zeros((k + 1, len(owner_ids)), dtype=int)
+    pinned = np.zeros(n, dtype=bool)
+
+    def place(i, c):
+        assign[i] = c
+        sum_strength[c] += strength[i]
+        sum_th[c] += town_hall[i]
+        count[c] += 1
+        owner_count[c, owner[i]] += 1
+
+    def remove(i):
+        c = assign[i]
+        sum_strength[c] -= strength[i]
+        sum_th[c] -= town_hall[i]
+        count[c] -= 1
+        owner_count[c, owner[i]] -= 1
+
+    def cost(ss, st, cnt, clan):
+        return np.where(is_clan[clan], _clan_cost(ss, st, cnt, targets[clan], th_weight), 0.0)
+
+    for i in sorted(pins, key=lambda i: -strength[i]):
+        c = pins[i]
+        fits = count[c] < capacity[c] and owner_count[c, owner[i]] < limit
+        place(i, c if fits else bench)
+        pinned[i] = True
+
+    clans = np.arange(k)
+    for i in np.argsort(-strength, kind='stable'):
+        if pinned[i]:
+            continue
+        open_clans = clans[(count[:k] < capacity[:k]) & (owner_count[:k, owner[i]] < limit)]
+        if not len(open_clans):
+            place(i, bench)
+            continue
+        before = cost(sum_strength[open_clans], sum_th[open_clans], count[open_clans], open_clans)
+        after = cost(sum_strength[open_clans] + strength[i], sum_th[open_clans] + town_hall[i], count[open_clans] + 1, open_clans)
+        place(i, open_clans[np.argmin(after - before)])
+
+    movable = np.flatnonzero(~pinned)
+    passes = 0
+    while passes < max_passes and time.perf_counter() - started < time_limit:
+        passes += 1
+        improved = False
+        for i in movable:
+            a = assign[i]
+            others = movable[assign[movable] != a]
+            if not len(others):
+                continue
+            b = assign[others]
+            same_owner = owner[others] == owner[i]
+            # Each side must stay within the owner cap after the swap
+            feasible = (
+                (~is_clan[a] | (owner_count[a, owner[others]] - same_owner < limit))
+                & (~is_clan[b] | (owner_count[b, owner[i]] - same_owner < limit))
+            )
+            if not feasible.any():
+                continue
+            ds = strength[others] - strength[i]
+            dt = town_hall[others] - town_hall[i]
+            delta = (
+                cost(sum_strength[a] + ds, sum_th[a] + dt, count[a], a)
+                + cost(sum_strength[b] - ds, sum_th[b] - dt, count[b], b)
+                - cost(sum_strength[a], sum_th[a], count[a], a)
+                - cost(sum_strength[b], sum_th[b], count[b], b)
+            )
+            delta = np.where(feasible, delta, np.inf)
+            best = np.argmin(delta)
+            if delta[best] < -1e-9:
+                j = others[best]
+                remove(i)
+                remove(j)
+                place(i, b[best])
+                place(j, a)
+                improved = True
+        if not improved:
+            break
+
+    total = float(cost(sum_strength, sum_th, count, np.arange(k + 1)).sum())
+    return assign, total, passes, time.perf_counter() - started
+
+
+def balance(members, clans, max_per_owner=1, th_weight=0.5, time_limit=0.8):
+    """Split BalanceMembers across ClanTargets; members pinned to a clan tag stay there when it has room."""
+    clan_index = {clan.tag: index for index, clan in enumerate(clans)}
+    pins = {index: clan_index[member.pin] for index, member in enumerate(members) if member.pin in clan_index}
+    assign, total, passes, elapsed = solve(
+        [member.strength for member in members],
+        [member.town_hall for member in members],
+        [member.owner for member in members],
+        pins,
+        [clan.size for clan in clans],
+        [clan.target for clan in clans],
+        max_per_owner=max_per_owner,
+        th_weight=th_weight,
+        time_limit=time_limit,
+    )
+    lineups = [[] for _ in clans]
+    bench = []
+    for member, clan in zip(members, assign):
+        (lineups[clan] if clan < len(clans) else bench).append(member)
+    for lineup in lineups:
+        lineup.sort(key=lambda member: -member.strength)
+    bench.sort(key=lambda member: -member.strength)
+    overflow = [member for index, member in enumerate(members) if index in pins and assign[index] == len(clans)]
+    return BalanceResult(clans, lineups, bench, overflow, total, passes, elapsed)
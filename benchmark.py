@@ -0,0 +1,332 @@
+"""Offline benchmark for the slash commands.
+
+Drives the command callbacks in coctest.py against in-process stand-ins for
+Discord, the CoC API and Google Sheets, with configurable latency and error
+injection, and reports throughput, tail latency and event-loop lag:
+
+    python benchmark.py --requests 500 --concurrency 50 --coc-latency 0.15
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import coc
+import gspread
+
+HERO_NAMES = ('Barbarian King', 'Archer Queen', 'Grand Warden', 'Royal Champion', 'Minion Prince')
+SHEET_URL = 'https://docs.google.com/spreadsheets/d/benchmark-sheet/edit'
+
+
+class Latency:
+    """Sleep time and failure probability for one fake backend."""
+
+    def __init__(self, mean, jitter=0.5, error_rate=0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def sample(self):
+        return max(0.0, random.gauss(self.mean, self.mean * self.jitter))
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+class Obj:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def make_tag(index):
+    return f"#BENCH{index:05d}"
+
+
+def make_player(tag, index):
+    town_hall = 9 + index % 9
+    return Obj(
+        tag=tag,
+        name=f"Player {index}",
+        town_hall=town_hall,
+        trophies=random.randint(0, 6000),
+        clan=Obj(tag=f"#CLAN{index % 5}", name=f"Clan {index % 5}"),
+        heroes=[Obj(name=name, level=random.randint(1, 95)) for name in HERO_NAMES[:town_hall // 3]],
+        pets=[],
+        equipment=[Obj(level=random.randint(1, 18), max_level=18) for _ in range(4)],
+        _response_retry=0,
+        _raw_data=None,
+    )
+
+
+class FakeCocClient:
+    def __init__(self, latency, accounts):
+        self.latency = latency
+        self.accounts = accounts
+        self.calls = 0
+
+    async def _call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        if self.latency.fails():
+            raise coc.errors.HTTPException(random.choice((429, 503)), {'reason': 'injected'})
+
+    async def get_player(self, tag):
+        await self._call()
+        return make_player(tag, int(tag[6:]) if tag[6:].isdigit() else 0)
+
+    async def get_clan(self, tag):
+        await self._call()
+        # Clan k holds every fifth account, like the CLAN column of the fake sheet, plus a few accounts the sheet does not know
+        k = int(tag[5:]) if tag[5:].isdigit() else 0
+        indexes = list(range(k, self.accounts, 5))[:45] + list(range(self.accounts, self.accounts + 5))
+        members = [Obj(tag=make_tag(index), name=f"Player {index}", town_hall=9 + index % 9) for index in indexes]
+        return Obj(tag=tag, name=f"Clan {k}", description="Benchmark clan", level=20, members=members, war_league=Obj(name='Master League I'))
+
+    async def close(self):
+        pass
+
+
+class FakeWorksheet:
+    def __init__(self, rows, latency):
+        self.rows = rows
+        self.latency = latency
+        self.updates = 0
+
+    def row_values(self, row):
+        time.sleep(self.latency.sample() / 4)
+        return list(self.rows[0]) if self.rows else []
+
+    def batch_get(self, ranges, major_dimension=None):
+        # Called from the Sheets thread pool, so a blocking sleep is the honest stand-in
+        time.sleep(self.latency.sample())
+        if self.latency.fails():
+            raise gspread.exceptions.GSpreadException('injected')
+        headers = list(self.rows[0])
+        columns = []
+        for cell_range in ranges:
+            header = headers[gspread.utils.a1_range_to_grid_range(cell_range)['startColumnIndex']]
+            columns.append([[header] + [row[header] for row in self.rows]])
+        return columns
+
+
+    def batch_update(self, data, value_input_option=None):
+        time.sleep(self.latency.sample())
+        headers = list(self.rows[0])
+        for item in data:
+            grid = gspread.utils.a1_range_to_grid_range(item['range'])
+            header = headers[grid['startColumnIndex']]
+            for offset, (value,) in enumerate(item['values']):
+                self.rows[grid['startRowIndex'] - 1 + offset][header] = value
+        self.updates += 1
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+    def get_lastUpdateTime(self):
+        time.sleep(self.sheet1.latency.sample() / 4)
+        return '2025-01-01T00:00:00Z'
+
+
+class FakeGspreadClient:
+    def __init__(self, rows, latency):
+        self.spreadsheet = FakeSpreadsheet(FakeWorksheet(rows, latency))
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+    def set_timeout(self, timeout):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+        await self.interaction.send()
+
+    async def send_message(self, *args, **kwargs):
+        self._done = True
+        await self.interaction.send(*args, **kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        await self.interaction.send(*args, **kwargs)
+
+
+class FakeInteraction:
+    """Enough of discord.Interaction for the command callbacks."""
+
+    def __init__(self, user_id, guild_id, latency):
+        self.latency = latency
+        self.user = Obj(id=user_id, name=f"user{user_id}")
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.extras = {}
+        self.command = None
+        self.guild_id = guild_id
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sends = 0
+        self.failed = False
+
+    async def send(self, content=None, embed=None, **kwargs):
+        self.sends += 1
+        self.failed = self.failed or is_error_reply(content, embed)
+        await asyncio.sleep(self.latency.sample())
+
+    async def edit_original_response(self, **kwargs):
+        await self.send(**kwargs)
+
+
+def is_error_reply(content, embed):
+    """Whether a reply is one of the bot's error messages ("Error" embeds, "... error:" or "Something went wrong" text)."""
+    if embed is not None and (embed.title == "Error" or (embed.description or '').startswith("Error:")):
+        return True
+    text = str(content or '')
+    return text.startswith(("Error:", "Something went wrong")) or text.split(':', 1)[0].endswith(" error")
+
+
+def make_rows(accounts, owners):
+    return [
+        {'ID': str(100000 + index % owners), 'TAG': make_tag(index), 'NAME': f"Player {index}", 'CLAN': f"Clan {index % 5}", 'Town-Hall': str(9 + index % 9)}
+        for index in range(accounts)
+    ]
+
+
+def load_bot(args):
+    os.environ['CACHE_DB'] = ''
+    os.environ['GUILD_RATE_LIMIT'] = str(args.guild_rate)
+    # Keep benchmark noise out of the bot's log files
+    os.environ['LOG_FILE'] = ''
+    os.environ['LOG_JSON_FILE'] = ''
+    # Sheets credentials are only loaded at startup, so importing the bot needs no service account
+    import coctest
+    coc_client = FakeCocClient(Latency(args.coc_latency, error_rate=args.error_rate), args.accounts)
+    coctest.coc_client = coc_client
+    coctest.fetcher.attach(coc_client)
+    coctest.sheets_io.gs_client = FakeGspreadClient(make_rows(args.accounts, args.owners), Latency(args.sheet_latency, error_rate=args.error_rate))
+    for guild_id in range(1, args.guilds + 1):
+        coctest.guilds.get(guild_id).sheet_url = SHEET_URL
+    return coctest
+
+
+def command_calls(bot, args):
+    """Callables producing one coroutine per request for each benchmarked command."""
+    return {
+        'player': lambda inter: bot.player.callback(inter, make_tag(random.randrange(args.accounts))),
+        'profile': lambda inter: bot.profile.callback(inter, None),
+        'claninfo': lambda inter: bot.claninfo.callback(inter, f"#CLAN{random.randrange(5)}"),
+        'clanreport': lambda inter: bot.clanreport.callback(inter, f"#CLAN{random.randrange(5)}"),
+        'update_all': lambda inter: bot.update_all.callback(inter, SHEET_URL),
+    }
+
+
+async def measure_loop_lag(samples, interval=0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def rejected(bot, name):
+    return bot.metrics.counters.get(('commands_rejected', (('command', name),)), 0)
+
+
+async def run_command(bot, name, make_call, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        interaction = FakeInteraction(100000 + random.randrange(args.owners), random.randint(1, args.guilds), Latency(args.discord_latency))
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await make_call(interaction)
+            except Exception:
+                interaction.failed = True
+            # Commands catch their own failures and reply with an error message; count those too
+            errors += interaction.failed
+            latencies.append(time.perf_counter() - started)
+
+    rejected_before = rejected(bot, name)
+    lag = []
+    probe = asyncio.create_task(measure_loop_lag(lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    probe.cancel()
+    return {
+        'command': name,
+        'requests': args.requests,
+        'errors': errors,
+        'busy': rejected(bot, name) - rejected_before,
+        'throughput': args.requests / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'loop_lag_p99_ms': percentile(lag, 0.99) * 1000,
+        'loop_lag_max_ms': max(lag, default=0.0) * 1000,
+        'loop_lag_mean_ms': statistics.fmean(lag) * 1000 if lag else 0.0,
+    }
+
+
+async def main(args):
+    random.seed(args.seed)
+    bot = load_bot(args)
+    calls = command_calls(bot, args)
+    results = []
+    for name in args.commands:
+        results.append(await run_command(bot, name, calls[name], args))
+    bot.sheets_io.close()
+    print(f"{'command':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'lag p99':>10}{'lag max':>10}{'errors':>8}{'busy':>6}")
+    for r in results:
+        print(f"{r['command']:<12}{r['throughput']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['loop_lag_p99_ms']:>10.1f}{r['loop_lag_max_ms']:>10.1f}{r['errors']:>8}{r['busy']:>6}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', nargs='+', default=['player', 'profile', 'claninfo', 'update_all'], choices=['player', 'profile', 'claninfo', 'clanreport', 'update_all'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--accounts', type=int, default=300)
+    parser.add_argument('--owners', type=int, default=120)
+    parser.add_argument('--guilds', type=int, default=1, help="Spread requests over this many servers bound to the same sheet")
+    parser.add_argument('--guild-rate', type=float, default=10.0, help="Per-server CoC API budget in requests per second")
+    parser.add_argument('--coc-latency', type=float, default=0.15)
+    parser.add_argument('--sheet-latency', type=float, default=0.8)
+    parser.add_argument('--discord-latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main(parse_args())) else 1)
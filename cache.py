@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import coc
+
+from fetcher import NotConnected
+
+
+class TTLCache:
+    """In-memory LRU bounded by entry count, with a per-entry expiry."""
+
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, allow_stale=False):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time() and not allow_stale:
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+    def expires_at(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry else 0.0
+
+
+class SqliteTier:
+    """Local state in SQLite so a restart starts warm. All queries run on one worker thread.
+
+    Holds raw API payloads, each guild's sheet binding, the last roster read
+    from every sheet and the ingested CWL attacks, all with timestamps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS api_cache ('
+                'kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, expires_at REAL NOT NULL, '
+                'PRIMARY KEY (kind, key))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS guild_sheets ('
+                'guild_id INTEGER PRIMARY KEY, sheet_url TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS roster_snapshots ('
+                'sheet_id TEXT PRIMARY KEY, rows TEXT NOT NULL, version TEXT, saved_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS war_attacks ('
+                'war_tag TEXT NOT NULL, season TEXT NOT NULL, attacker TEXT NOT NULL, attack_order INTEGER NOT NULL, '
+                'stars INTEGER NOT NULL, destruction REAL NOT NULL, th_diff INTEGER NOT NULL, '
+                'PRIMARY KEY (war_tag, attacker, attack_order))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS wars ('
+                'war_tag TEXT PRIMARY KEY, state TEXT, last_order INTEGER NOT NULL, ours INTEGER NOT NULL, updated_at REAL NOT NULL)'
+            )
+        return self._conn
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, kind, key):
+        row = self._connect().execute('SELECT data, expires_at FROM api_cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _put(self, kind, key, data, expires_at):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO api_cache VALUES (?, ?, ?, ?)', (kind, key, json.dumps(data), expires_at))
+
+    def _get_bindings(self):
+        return dict(self._connect().execute('SELECT guild_id, sheet_url FROM guild_sheets').fetchall())
+
+    def _put_binding(self, guild_id, sheet_url):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO guild_sheets VALUES (?, ?, ?)', (guild_id, sheet_url, time.time()))
+
+    def _get_roster(self, sheet_id):
+        row = self._connect().execute('SELECT rows, version, saved_at FROM roster_snapshots WHERE sheet_id = ?', (sheet_id,)).fetchone()
+        if not row:
+            return None
+        return {fields[1]: tuple(fields) for fields in json.loads(row[0])}, row[1], row[2]
+
+    def _put_roster(self, sheet_id, rows, version):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO roster_snapshots VALUES (?, ?, ?, ?)', (sheet_id, json.dumps(list(rows.values())), version, time.time()))
+
+    def _get_war_history(self):
+        conn = self._connect()
+        attacks = conn.execute('SELECT war_tag, season, attacker, attack_order, stars, destruction, th_diff FROM war_attacks ORDER BY rowid').fetchall()
+        wars = {row[0]: (row[1], row[2], bool(row[3])) for row in conn.execute('SELECT war_tag, state, last_order, ours FROM wars')}
+        return attacks, wars
+
+    def _put_war_history(self, attacks, wars):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany('INSERT OR IGNORE INTO war_attacks VALUES (?, ?, ?, ?, ?, ?, ?)', attacks)
+            conn.executemany('INSERT OR REPLACE INTO wars VALUES (?, ?, ?, ?, ?)', [(tag, state, order, int(ours), now) for tag, (state, order, ours) in wars.items()])
+
+    async def get(self, kind, key):
+        return await self.run(self._get, kind, key)
+
+    async def put(self, kind, key, data, expires_at):
+        await self.run(self._put, kind, key, data, expires_at)
+
+    async def get_bindings(self):
+        """`{guild_id: sheet_url}` for every guild that has bound a sheet."""
+        return await self.run(self._get_bindings)
+
+    async def put_binding(self, guild_id, sheet_url):
+        await self.run(self._put_binding, guild_id, sheet_url)
+
+    async def get_roster(self, sheet_id):
+        """`(rows, version, saved_at)` for the last roster read from `sheet_id`, or None."""
+        return await self.run(self._get_roster, sheet_id)
+
+    async def put_roster(self, sheet_id, rows, version):
+        await self.run(self._put_roster, sheet_id, rows, version)
+
+    async def get_war_history(self):
+        """`(attack rows, {war_tag: (state, last_order, ours)})` as saved by WarTracker."""
+        return await self.run(self._get_war_history)
+
+    async def put_war_history(self, attacks, wars):
+        await self.run(self._put_war_history, attacks, wars)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._conn is not None:
+            self._conn.close()
+
+
+class PlayerCache:
+    """Read-through cache for players and clans in front of a PlayerFetcher.
+
+    Entries live for at least `ttl` seconds, or longer when the API's
+    Cache-Control says the data will not change sooner. Misses fall through
+    to the optional SQLite tier and then to the API; if the API fails, a
+    stale copy is served instead of an error. Copies that expired less than
+    `max_stale` seconds ago are served straight away while a background
+    refresh replaces them, which is what makes lookups after a restart fast.
+
+    Every newly fetched object is passed to each listener as
+    `(kind, tag, previous, obj)`, where `previous` is the copy it replaces
+    (or None), so changes can be acted on wherever the fetch came from.
+    """
+
+    def __init__(self, fetcher, max_size=2000, ttl=300.0, disk=None, max_stale=0.0):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.disk = disk
+        self.max_stale = max_stale
+        self._refreshing = set()
+        self._pending = {}
+        self.listeners = []
+        self.memory = TTLCache(max_size)
+        self.hits = self.disk_hits = self.misses = self.stale_hits = 0
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'size': len(self.memory),
+        }
+
+    def _expiry(self, obj, ttl=None):
+        return time.time() + max(ttl or self.ttl, getattr(obj, '_response_retry', None) or 0)
+
+    def peek(self, kind, tag):
+        return self.memory.get((kind, tag), allow_stale=True)
+
+    def expires_within(self, kind, tag, seconds):
+        return self.memory.expires_at((kind, tag)) <= time.time() + seconds
+
+    def store(self, kind, tag, obj, ttl=None):
+        expires_at = self._expiry(obj, ttl)
+        previous = self.memory.get((kind, tag), allow_stale=True)
+        self.memory.put((kind, tag), obj, expires_at)
+        for listener in self.listeners:
+            try:
+                listener(kind, tag, previous, obj)
+            except Exception:
+                logging.exception(f"Cache listener failed for {kind} {tag}")
+        raw = getattr(obj, '_raw_data', None)
+        if self.disk and raw:
+            task = asyncio.ensure_future(self.disk.put(kind, tag, raw, expires_at))
+            task.add_done_callback(self._log_write_failure)
+
+    @staticmethod
+    def _log_write_failure(task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"Cache write failed: {task.exception()}")
+
+    async def _background_refresh(self, kind, tag, fetch, budget):
+        try:
+            if budget is not None:
+                await budget.acquire()
+            self.store(kind, tag, await fetch(tag))
+        except coc.errors.ClashOfClansException as e:
+            logging.warning(f"Background refresh failed for {kind} {tag}: {e}")
+        finally:
+            self._refreshing.discard((kind, tag))
+
+    def _serve_stale(self, kind, tag, fetch, budget):
+        key = (kind, tag)
+        if time.time() - self.memory.expires_at(key) >= self.max_stale:
+            return False
+        if key not in self._refreshing:
+            self._refreshing.add(key)
+            asyncio.ensure_future(self._background_refresh(kind, tag, fetch, budget))
+        return True
+
+    async def _get(self, kind, tag, fetch, model, budget=None):
+        key = (kind, tag)
+        obj = self.memory.get(key)
+        if obj is not None:
+            self.hits += 1
+            return obj
+        stale = self.memory.get(key, allow_stale=True)
+        if self.disk and stale is None:
+            row = await self.disk.get(kind, tag)
+            if row:
+                # Before the CoC login there is no client to load game data from; serve the raw payload
+                client = self.fetcher.client
+                obj = model(data=row[0], client=client, load_game_data=None if client else False)
+                self.memory.put(key, obj, row[1])
+                if row[1] > time.time():
+                    self.disk_hits += 1
+                    return obj
+                stale = obj
+        if stale is not None and self._serve_stale(kind, tag, fetch, budget):
+            self.stale_hits += 1
+            return stale
+        self.misses += 1
+        try:
+            return await self._shared_fetch(kind, tag, fetch, budget)
+        except (coc.errors.Maintenance, coc.errors.GatewayError, NotConnected):
+            if stale is None:
+                raise
+            self.stale_hits += 1
+            return stale
+
+    async def _fetch(self, kind, tag, fetch, budget):
+        if budget is not None:
+            await budget.acquire()
+        obj = await fetch(tag)
+        self.store(kind, tag, obj)
+        return obj
+
+    async def _shared_fetch(self, kind, tag, fetch, budget):
+        # Callers missing on the same entry share one fetch, so only the first one spends budget
+        key = (kind, tag)
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._fetch(kind, tag, fetch, budget))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def refresh(self, kind, tag):
+        """Re-fetch an entry from the API regardless of its expiry."""
+        fetch = self.fetcher.get_player if kind == 'player' else self.fetcher.get_clan
+        obj = await fetch(tag)
+        self.store(kind, tag, obj)
+        return obj
+
+    async def get_player(self, tag, budget=None):
+        """Cached player; on a miss the API call first takes a token from `budget` when one is given."""
+        return await self._get('player', tag, self.fetcher.get_player, coc.Player, budget)
+
+    async def get_clan(self, tag, budget=None):
+        return await self._get('clan', tag, self.fetcher.get_clan, coc.Clan, budget)
+
+    async def _fetch_one(self, tag, budget):
+        try:
+            return tag, await self.get_player(tag, budget), None
+        except coc.errors.ClashOfClansException as e:
+            return tag, None, e
+
+    async def stream(self, tags, budget=None):
+        """Yield `(tag, player, error)` for every unique tag, cached players first without touching the API."""
+        cached, pending = [], []
+        for tag in dict.fromkeys(tags):
+            player = self.memory.get(('player', tag))
+            if player is not None:
+                cached.append((tag, player, None))
+            else:
+                pending.append(asyncio.ensure_future(self._fetch_one(tag, budget)))
+        self.hits += len(cached)
+        try:
+            for result in cached:
+                yield result
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+import aiohttp
+import coc
+
+
+def parse_accounts(value):
+    """Parse `email:password,email:password` into (email, password) pairs."""
+    accounts = []
+    for item in (value or '').split(','):
+        email, _, password = item.strip().partition(':')
+        if email and password:
+            accounts.append((email, password))
+    return accounts
+
+
+def make_connector(limit=100, limit_per_host=50, keepalive_timeout=60.0):
+    # Keep-alive and a DNS cache so bulk refreshes reuse warm connections to the API host
+    return aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout, ttl_dns_cache=300)
+
+
+class PooledClient:
+    __slots__ = ('client', 'email', 'inflight', 'failures')
+
+    def __init__(self, client, email=None):
+        self.client = client
+        self.email = email
+        self.inflight = 0
+        self.failures = 0
+
+
+class ClientPool:
+    """Spreads CoC API requests over several logged-in clients.
+
+    One client is created per developer account (each with `key_count` keys,
+    which coc.py already rotates), plus one for any static tokens. Every
+    request goes to the client with the fewest requests in flight, preferring
+    clients that have not been failing. Anything not overridden here, such as
+    `raw_attribute` or game data used to build models, comes from the first
+    client, so the pool can stand in for a coc.Client.
+    """
+
+    def __init__(self, accounts=(), tokens=(), key_count=1, throttle_limit=30, base_url='https://api.clashofclans.com/v1', **client_kwargs):
+        self.accounts = list(accounts)
+        self.tokens = list(tokens)
+        self.key_count = key_count
+        self.throttle_limit = throttle_limit
+        self.base_url = base_url
+        self.client_kwargs = client_kwargs
+        self.members = []
+        self._next = 0
+
+    def _new_client(self):
+        return coc.Client(
+            key_count=self.key_count,
+            throttle_limit=self.throttle_limit,
+            base_url=self.base_url,
+            connector=make_connector(),
+            **self.client_kwargs
+        )
+
+    async def _login(self, email, password):
+        client = self._new_client()
+        try:
+            await client.login(email, password)
+        except Exception:
+            await client.close()
+            raise
+        return PooledClient(client, email)
+
+    async def login(self):
+        attempts = [self._login(email, password) for email, password in self.accounts]
+        results = await asyncio.gather(*attempts, return_exceptions=True)
+        for (email, _), result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                logging.error(f"CoC login failed for {email}: {result}")
+            else:
+                self.members.append(result)
+        if self.tokens:
+            client = self._new_client()
+            await client.login_with_tokens(*self.tokens)
+            self.members.append(PooledClient(client))
+        if not self.members:
+            raise coc.errors.InvalidCredentials("No CoC account in the pool could log in")
+        logging.info(f"CoC client pool ready: {len(self.members)} clients, {self.key_count} keys per account")
+
+    def __len__(self):
+        return len(self.members)
+
+    def __getattr__(self, name):
+        members = self.__dict__.get('members')
+        if not members:
+            raise AttributeError(name)
+        return getattr(members[0].client, name)
+
+    @property
+    def key_slots(self):
+        """How many API keys the pool spreads requests over."""
+        return sum(self.key_count if member.email else len(self.tokens) for member in self.members)
+
+    def _pick(self):
+        # Healthy clients with the fewest requests in flight win; ties go round-robin
+        self._next = (self._next + 1) % len(self.members)
+        rotated = self.members[self._next:] + self.members[:self._next]
+        return min(rotated, key=lambda member: (member.failures > 2, member.inflight))
+
+    async def request(self, method, *args, **kwargs):
+        member = self._pick()
+        member.inflight += 1
+        try:
+            result = await getattr(member.client, method)(*args, **kwargs)
+        except (coc.errors.Forbidden, coc.errors.Maintenance, coc.errors.GatewayError):
+            member.failures += 1
+            raise
+        finally:
+            member.inflight -= 1
+        member.failures = 0
+        return result
+
+    async def get_player(self, tag, **kwargs):
+        return await self.request('get_player', tag, **kwargs)
+
+    async def get_clan(self, tag, **kwargs):
+        return await self.request('get_clan', tag, **kwargs)
+
+    async def get_league_group(self, clan_tag, **kwargs):
+        return await self.request('get_league_group', clan_tag, **kwargs)
+
+    async def get_league_war(self, war_tag, **kwargs):
+        return await self.request('get_league_war', war_tag, **kwargs)
+
+    async def close(self):
+        await asyncio.gather(*(member.client.close() for member in self.members), return_exceptions=True)
+        self.members.clear()
+        logging.info("CoC client pool closed")
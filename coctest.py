@@ -5,59 +5,57 @@ from dotenv import load_dotenv
 import os
 import logging
 import asyncio
+import hashlib
+import io
+import json
+import math
+import statistics
+import time
+from collections import Counter
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import re
-
-# Logging setup
-logging.basicConfig(filename='discord.log', encoding='utf-8', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Emoji mappings
-HERO_EMOJIS = {
-    'Barbarian King': '<:BarbarianKing:1371194900636500089>',
-    'Archer Queen': '<:ArcherQueen:1371194890091892796>',
-    'Minion Prince': '<:MinionPrince:1371194909213855805>',
-    'Grand Warden': '<:GrandWarden:1371194905011163149>',
-    'Royal Champion': '<:RoyalChampion:1371194913177342175>'    
-}
-
-TOWN_HALL_EMOJIS = {
-    0: '<:TownHall1:1371194916604084394>',
-    1: '<:TownHall1:1371194916604084394>',
-    2: '<:TownHall2:1371194919837765822>',
-    3: '<:TownHall3:1371194924237721681>',
-    4: '<:TownHall4:1371194928486551562>',
-    5: '<:TownHall5:1371194932823330947>',
-    6: '<:TownHall6:1371194936896262245>',
-    7: '<:TownHall7:1371194941404872734>',
-    8: '<:TownHall8:1371194945679134811>',
-    9: '<:TownHall9:1371194950171099229>',
-    10: '<:TownHall10:1371194955179102308>',
-    11: '<:TownHall11:1371194959281000528>',
-    12: '<:TownHall12:1371194962426986696>',
-    13: '<:TownHall13:1371194967044915210>',
-    14: '<:TownHall14:1371194970165477437>',
-    15: '<:TownHall15:1371194974435016926>',
-    16: '<:TownHall16:1371194979166195723>',
-    17: '<:TownHall17:1371194983423414322>'
-}
-
-TROPHY_LEAGUE_EMOJIS = {
-    (0, 799): '<:Icon_Bronze:1371820654831341578>',
-    (800, 1399): '<:Icon_Silver:1371820651677220925>',
-    (1400, 1999): '<:Icon_Gold:1371820648220983337>',
-    (2000, 2599): '<:Icon_Crystal:1371820644785983689>',
-    (2600, 3199): '<:Icon_Master:1371820640545275975>',
-    (3200, 4099): '<:Icon_Champion:1371820636695040091>',
-    (4100, 4999): '<:Icon_Titan:1371820631892426794>',
-    (5000, float('inf')): '<:Icon_Legend:1371820627350130718>'
-}
+from sheets import SheetsIO, parse_sheet_id
+from roster import COLUMNS as ROSTER_COLUMNS, parse_rows
+from roster_cache import RosterCache
+from fetcher import PlayerFetcher
+from coc_pool import ClientPool, parse_accounts
+from cache import PlayerCache, SqliteTier
+from scoring import UNKNOWN_RUSH, score_roster, strength
+from prefetch import PrefetchScheduler
+from guilds import GuildRegistry
+from metrics import metrics
+from report import clan_report
+from sheet_sync import sync_roster
+from dispatch import CommandRunner, defer, send
+from wars import PRIOR_STARS, WarTracker, war_adjusted
+from logsetup import sample_rates_from_env, setup_logging
+from startup import Startup
+from autocomplete import SearchIndex
+from worker import WorkerPool, socket_paths
+from updates import UpdateFeed, clan_changes, player_changes
+from balance import LEAGUE_TARGETS, BalanceMember, ClanTarget, balance
+from render import HERO_EMOJIS, add_line_fields, account_line, build_pages, fragments, hero_line, join_lines, member_info, rush_summary, town_hall_emoji
 
 # Load environment variables
 load_dotenv()
+
+# Logging setup: file writes happen on a listener thread, see logsetup.py
+setup_logging(
+    os.getenv('LOG_FILE', 'discord.log'),
+    os.getenv('LOG_JSON_FILE', 'events.jsonl'),
+    max_bytes=int(os.getenv('LOG_MAX_BYTES', 5_000_000)),
+    backup_count=int(os.getenv('LOG_BACKUPS', 5)),
+    sample_rates=sample_rates_from_env(os.getenv('LOG_SAMPLE_RATES')),
+)
+events = logging.getLogger('cwl.events')
+
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 COC_EMAIL = os.getenv('COC_EMAIL')
 COC_PASSWORD = os.getenv('COC_PASSWORD')
+# Optional extra developer accounts (`email:password,...`) and static API tokens for more throughput
+COC_ACCOUNTS = parse_accounts(os.getenv('COC_ACCOUNTS')) or [(COC_EMAIL, COC_PASSWORD)]
+COC_TOKENS = [token.strip() for token in os.getenv('COC_TOKENS', '').split(',') if token.strip()]
+COC_KEY_COUNT = int(os.getenv('COC_KEY_COUNT', 1))
 
 API_BASE_URL = 'https://api.clashofclans.com/v1'
 
@@ -65,230 +63,805 @@ API_BASE_URL = 'https://api.clashofclans.com/v1'
 intents = discord.Intents.default()
 intents.members = True
 client = discord.Client(intents=intents)
-tree = discord.app_commands.CommandTree(client)
+
+class InstrumentedCommandTree(discord.app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        interaction.extras['started'] = time.perf_counter()
+        return True
+
+tree = InstrumentedCommandTree(client)
+METRICS_FILE = os.getenv('METRICS_FILE', 'metrics.prom')
+METRICS_EXPORT_INTERVAL = 60
 
 # Initialize CoC client
 coc_client = None
+# Both limits are per API key and scale with the size of the client pool
+COC_CONCURRENCY = int(os.getenv('COC_CONCURRENCY', 10))
+COC_RATE_LIMIT = float(os.getenv('COC_RATE_LIMIT', 30))
+# Split mode (see worker.py): bulk jobs run in this many worker processes; 0 runs everything in this one
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 0))
+# Processes logged in with the same keys, which split the limits above between them
+COC_PROCESSES = int(os.getenv('COC_PROCESSES', BOT_WORKERS + 1))
+fetcher = PlayerFetcher(concurrency=COC_CONCURRENCY, rate=COC_RATE_LIMIT)
+# Local store for API payloads, sheet bindings and roster snapshots
+CACHE_DB = os.getenv('CACHE_DB', 'bot_cache.db')
+store = SqliteTier(CACHE_DB) if CACHE_DB else None
+player_cache = PlayerCache(
+    fetcher,
+    max_size=int(os.getenv('PLAYER_CACHE_SIZE', 2000)),
+    ttl=float(os.getenv('PLAYER_CACHE_TTL', 300)),
+    disk=store,
+    max_stale=float(os.getenv('PLAYER_MAX_STALE', 900)),
+)
+PROGRESS_EDIT_INTERVAL = 1.0
+
+# Google Sheets: credentials are loaded on a Sheets worker thread during startup (or on first use), not at import
+SHEETS_SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE', 'service_account.json')
+
+def authorize_sheets():
+    creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, SHEETS_SCOPE)
+    return gspread.authorize(creds)
+
+sheets_io = SheetsIO(max_workers=int(os.getenv('SHEETS_WORKERS', 4)), timeout=float(os.getenv('SHEETS_TIMEOUT', 30)), authorize=authorize_sheets)
+
+runner = CommandRunner(
+    max_running=int(os.getenv('COMMAND_CONCURRENCY', 16)),
+    max_pending=int(os.getenv('COMMAND_QUEUE_SIZE', 64)),
+    per_user=int(os.getenv('COMMANDS_PER_USER', 2)),
+    per_guild=int(os.getenv('COMMANDS_PER_GUILD', 8)),
+)
+metrics.register('command_runner', lambda: runner.stats)
 
-# Initialize Google Sheets client
-scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-creds = ServiceAccountCredentials.from_json_keyfile_name('service_account.json', scope)
-gs_client = gspread.authorize(creds)
+guilds = GuildRegistry(rate=float(os.getenv('GUILD_RATE_LIMIT', 10)), store=store)
 
-sheet_url = None
+# Sheets auth, CoC login and command sync come up independently; failures are retried in the background
+startup = Startup(base_delay=float(os.getenv('STARTUP_RETRY_DELAY', 2)), max_delay=float(os.getenv('STARTUP_MAX_RETRY_DELAY', 300)))
+metrics.register('startup', lambda: startup.stats)
 
 async def init_coc_client():
     global coc_client
+    logging.info("Initializing CoC client...")
+    pool = ClientPool(COC_ACCOUNTS, COC_TOKENS, key_count=COC_KEY_COUNT, throttle_limit=max(1, int(COC_RATE_LIMIT / COC_PROCESSES)), base_url=API_BASE_URL, raw_attribute=True)
     try:
-        logging.info("Initializing CoC client...")
-        coc_client = coc.Client(base_url=API_BASE_URL)
-        await coc_client.login(COC_EMAIL, COC_PASSWORD)
-        logging.info("CoC client initialized")
-    except Exception as e:
-        logging.error(f"CoC client error: {e}")
-        coc_client = None
+        await pool.login()
+    except Exception:
+        await pool.close()
+        raise
+    share = pool.key_slots / COC_PROCESSES
+    fetcher.resize(max(1, int(COC_CONCURRENCY * share)), COC_RATE_LIMIT * share)
+    fetcher.attach(pool)
+    coc_client = pool
+    logging.info(f"CoC client initialized with {pool.key_slots} API keys")
+
+def start_background_tasks():
+    prefetcher.start()
+    war_tracker.start()
+
+# Digest of the command set Discord already has per server, so restarts skip unchanged syncs
+synced_commands = {}
+
+def command_digest(guild):
+    payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_guild(guild, force=False):
+    tree.copy_global_to(guild=guild)
+    digest = command_digest(guild)
+    if guild.id not in synced_commands and store:
+        row = await store.get('command_sync', str(guild.id))
+        if row:
+            synced_commands[guild.id] = row[0]
+    if not force and synced_commands.get(guild.id) == digest:
+        logging.info(f"Slash commands unchanged for server {guild.id}, sync skipped")
+        return
+    await tree.sync(guild=guild)
+    synced_commands[guild.id] = digest
+    if store:
+        await store.put('command_sync', str(guild.id), digest, math.inf)
+    logging.info(f"Slash commands synced to server {guild.id}")
+
+async def sync_commands():
+    results = await asyncio.gather(*(sync_guild(guild) for guild in client.guilds), return_exceptions=True)
+    failed = [(guild, result) for guild, result in zip(client.guilds, results) if isinstance(result, Exception)]
+    for guild, error in failed:
+        logging.error(f"Sync error for server {guild.id}: {error}")
+    if failed:
+        raise RuntimeError(f"Command sync failed for {len(failed)} of {len(results)} servers")
+
+def start_subsystems(background_tasks=True):
+    # No-ops for subsystems that are already up or still starting
+    startup.start('sheets', sheets_io.connect)
+    startup.start('coc', init_coc_client, on_ready=start_background_tasks if background_tasks else None)
 
 @client.event
 async def on_ready():
-    await init_coc_client()
-    guild_id = 1209053585418223646
-    guild = discord.Object(id=guild_id)
-    if any(g.id == guild_id for g in client.guilds):
+    start_subsystems()
+    startup.start('commands', sync_commands)
+    global metrics_task
+    if metrics_task is None or metrics_task.done():
+        metrics_task = asyncio.create_task(export_metrics())
+    if not client.guilds:
+        logging.error("Bot is not in any server. Invite with 'bot' and 'applications.commands' scopes: https://discord.com/developers/applications")
+    print("ready")
+
+@client.event
+async def on_guild_join(guild):
+    try:
+        await sync_guild(guild, force=True)
+    except Exception as e:
+        logging.error(f"Sync error for server {guild.id}: {e}")
+
+metrics_task = None
+
+async def export_metrics():
+    while True:
         try:
-            await tree.sync(guild=guild)
-            logging.info(f"Slash commands synced to server {guild_id}")
-            print("ready")
-        except Exception as e:
-            logging.error(f"Sync error for server {guild_id}: {e}")
-            print(f"Sync failed: {e}")
-    else:
-        logging.error(f"Bot not in server {guild_id}. Invite with 'bot' and 'applications.commands' scopes: https://discord.com/developers/applications")
-        print(f"Bot not in server {guild_id}")
+            await asyncio.to_thread(metrics.write_prometheus, METRICS_FILE)
+        except OSError as e:
+            logging.error(f"Metrics export failed: {e}")
+        await asyncio.sleep(METRICS_EXPORT_INTERVAL)
+
+def record_command(interaction, status):
+    started = interaction.extras.get('started')
+    name = interaction.command.name if interaction.command else 'unknown'
+    latency = time.perf_counter() - started if started is not None else None
+    if latency is not None:
+        metrics.observe('command_seconds', latency, command=name)
+    metrics.incr('commands', command=name, status=status)
+    namespace = getattr(interaction, 'namespace', None)
+    events.info(f"Command {name} {status}", extra={
+        'event': 'command',
+        'command': name,
+        'guild': interaction.guild_id,
+        'user': interaction.user.id,
+        'tag': getattr(namespace, 'tag', None) or getattr(namespace, 'clan_tag', None),
+        'status': status,
+        'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+    })
 
-async def get_sheet_data(url):
+@client.event
+async def on_app_command_completion(interaction, command):
+    record_command(interaction, 'ok')
+
+@tree.error
+async def on_app_command_error(interaction, error):
+    record_command(interaction, 'error')
+    logging.error(f"Command {interaction.command.name if interaction.command else 'unknown'} failed: {error}", exc_info=error)
     try:
-        match = re.match(r'https://docs\.google\.com/spreadsheets/d/([a-zA-Z0-9-_]+)/', url)
-        if not match:
+        await respond(interaction, "Something went wrong running this command.", ephemeral=True)
+    except discord.HTTPException as e:
+        logging.error(f"Could not report command error: {e}")
+
+async def respond(interaction, *args, **kwargs):
+    # Falls back to a followup when the runner already deferred the interaction
+    with metrics.span('discord_send_seconds', kind='response'):
+        await send(interaction, *args, **kwargs)
+
+async def followup(interaction, *args, **kwargs):
+    with metrics.span('discord_send_seconds', kind='followup'):
+        await interaction.followup.send(*args, **kwargs)
+
+async def edit_response(interaction, *args, **kwargs):
+    with metrics.span('discord_send_seconds', kind='edit'):
+        await interaction.edit_original_response(*args, **kwargs)
+
+async def fetch_roster(sheet_id):
+    return parse_rows(await sheets_io.read_columns(sheet_id, ROSTER_COLUMNS))
+
+roster_cache = RosterCache(sheets_io, fetch_roster, ttl=float(os.getenv('ROSTER_TTL', 300)), max_stale=float(os.getenv('ROSTER_MAX_STALE', 3600)), store=store)
+
+metrics.register('player_cache', lambda: player_cache.stats)
+metrics.register('render_fragments', lambda: fragments.stats)
+
+def evict_removed_accounts(sheet_id, diff):
+    for account in diff.removed:
+        player_cache.memory.pop(('player', account.tag))
+
+roster_cache.listeners.append(evict_removed_accounts)
+
+# Clans whose CWL wars are tracked, on top of any clan holding WAR_MIN_ACCOUNTS roster accounts
+WAR_CLANS = [coc.utils.correct_tag(tag) for tag in os.getenv('WAR_CLANS', '').split(',') if tag.strip()]
+WAR_MIN_ACCOUNTS = int(os.getenv('WAR_MIN_ACCOUNTS', 5))
+# Seasons of war history that count towards /warstats and balancing
+WAR_SEASONS = int(os.getenv('WAR_SEASONS', 3))
+
+def family_clans():
+    counts = Counter()
+    for sheet_id in guilds.sheet_ids():
+        snapshot = roster_cache.peek(sheet_id)
+        if snapshot is None:
+            continue
+        for tag in snapshot.roster.tags:
+            player = player_cache.peek('player', tag)
+            if player is not None and player.clan:
+                counts[player.clan.tag] += 1
+    return set(WAR_CLANS) | {tag for tag, count in counts.items() if count >= WAR_MIN_ACCOUNTS}
+
+war_tracker = WarTracker(fetcher, family_clans, store=store, rate=float(os.getenv('WAR_POLL_RATE', 2)))
+
+# Polls every roster account and family clan; commands then mostly read what it already fetched
+prefetcher = PrefetchScheduler(
+    roster_cache, player_cache, guilds.sheet_ids,
+    rate=float(os.getenv('PREFETCH_RATE', 5)),
+    clan_tags=family_clans,
+    batch_size=int(os.getenv('PREFETCH_BATCH', 20)),
+)
+
+# Channel that gets debounced roster updates (town halls, heroes, clan moves, joins and leaves); 0 disables posting
+UPDATES_CHANNEL_ID = int(os.getenv('UPDATES_CHANNEL_ID', 0))
+
+async def post_updates(lines):
+    channel = client.get_channel(UPDATES_CHANNEL_ID) or await client.fetch_channel(UPDATES_CHANNEL_ID)
+    embed = discord.Embed(title="Roster Updates", color=discord.Color.gold(), timestamp=discord.utils.utcnow())
+    add_line_fields(embed, "Changes", lines)
+    embed.set_footer(text="CWL Balance Boss")
+    await channel.send(embed=embed)
+
+update_feed = UpdateFeed(post_updates, quiet=float(os.getenv('UPDATES_QUIET', 60)), max_delay=float(os.getenv('UPDATES_MAX_DELAY', 600)))
+metrics.register('update_feed', lambda: update_feed.stats)
+
+def publish_update(key, before, after, describe, tag):
+    events.info(describe(before, after), extra={'event': 'update', 'tag': tag})
+    if UPDATES_CHANNEL_ID:
+        update_feed.add(key, before, after, describe)
+
+def track_changes(kind, tag, previous, obj):
+    if kind == 'player':
+        # Live name and town hall go into the roster's overlay; players outside every roster are not reported
+        if not roster_cache.apply(tag, name=obj.name, town_hall=obj.town_hall):
+            return
+        if obj.clan:
+            index_clan(obj.clan)
+        if previous is None:
+            return
+        for field, before, after in player_changes(previous, obj):
+            subject = f"{obj.name} ({tag})"
+            publish_update(('player', tag, field), before, after, lambda before, after, subject=subject, field=field: f"{subject}: {field} {before} → {after}", tag)
+    elif kind == 'clan':
+        family = tag in family_clans()
+        if family or tag in clan_index:
+            index_clan(obj)
+        if previous is None or not family:
+            return
+        for member_tag, name, joined in clan_changes(previous, obj):
+            subject = f"{name} ({member_tag})"
+            publish_update(('member', tag, member_tag), not joined, joined, lambda before, after, subject=subject: f"{subject} {'joined' if after else 'left'} {obj.name}", member_tag)
+
+player_cache.listeners.append(track_changes)
+
+# Autocomplete indexes, answered from memory only: roster accounts per sheet, and every clan seen
+account_indexes = {}
+clan_index = SearchIndex()
+for clan_tag in WAR_CLANS:
+    clan_index.set(clan_tag, clan_tag, [clan_tag])
+
+def search_keys(tag, name):
+    # Tag, full name and each word of the name, so "slayer" finds "King Slayer"
+    return (tag, name, *name.split())
+
+def account_entry(account):
+    account = roster_cache.live_view(account)
+    return account.tag, f"{account.name} ({account.tag}) TH{account.town_hall}", search_keys(account.tag, account.name)
+
+def index_clan(clan):
+    clan_index.set(clan.tag, f"{clan.name} ({clan.tag})", search_keys(clan.tag, clan.name))
+
+def account_index(sheet_id):
+    index = account_indexes.get(sheet_id)
+    if index is None:
+        snapshot = roster_cache.peek(sheet_id)
+        if snapshot is None:
+            return None
+        index = account_indexes[sheet_id] = SearchIndex()
+        index.extend(account_entry(account) for account in snapshot.roster)
+    return index
+
+def update_account_index(sheet_id, diff):
+    index = account_indexes.get(sheet_id)
+    if index is None:
+        return
+    roster = roster_cache.peek(sheet_id).roster
+    for tag in diff.tags:
+        account = roster.get(tag)
+        if account is None:
+            index.discard(tag)
+        else:
+            index.set(*account_entry(account))
+
+roster_cache.listeners.append(update_account_index)
+
+def update_live_account(tag):
+    for sheet_id, index in account_indexes.items():
+        account = roster_cache.peek(sheet_id).roster.get(tag)
+        if account is not None:
+            index.set(*account_entry(account))
+
+roster_cache.live_listeners.append(update_live_account)
+
+async def get_sheet_data(url, force=False):
+    try:
+        sheet_id = parse_sheet_id(url)
+        if not sheet_id:
             logging.error(f"Invalid sheet URL: {url}")
             return None
-        sheet_id = match.group(1)
-        worksheet = gs_client.open_by_key(sheet_id).sheet1
-        data = worksheet.get_all_records()
-        return [
-            {
-                'discord_id': str(row['ID']).strip(),
-                'tag': str(row['TAG']).strip().upper(),
-                'name': str(row['NAME']).strip(),
-                'clan': str(row['CLAN']).strip(),
-                'town_hall': str(row['Town-Hall']).strip()
-            }
-            for row in data if str(row['ID']).strip() and str(row['TAG']).strip().startswith('#')
-        ]
+        with metrics.span('get_sheet_data_seconds'):
+            snapshot = await roster_cache.get(sheet_id, force=force)
+        return snapshot.roster
+    except asyncio.TimeoutError:
+        logging.error(f"Sheet timeout after {sheets_io.timeout}s: {url}")
+        return None
     except Exception as e:
         logging.error(f"Sheet error: {e}")
+        sheets_io.forget(sheet_id)
         return None
 
 @tree.command(name="update_all", description="Verify and store Google Sheet URL")
 @discord.app_commands.describe(link="Google Sheet URL")
+@runner.command
 async def update_all(interaction: discord.Interaction, link: str):
-    await interaction.response.defer()
+    await defer(interaction)
 
     try:
-        global sheet_url
-        if not coc_client:
-            await interaction.followup.send("CoC API not initialized.")
-            return
-
-        data = await get_sheet_data(link)
-        if data is None:
+        # Concurrent re-binds of the same sheet share one forced reload
+        roster = await runner.coalesce(('update_all', link), lambda: get_sheet_data(link, force=True))
+        if roster is None:
             embed = discord.Embed(title="Error", description="Failed to access sheet", color=discord.Color.red())
-            await interaction.followup.send(embed=embed)
+            await followup(interaction, embed=embed)
             return
 
-        sheet_url = link
-        embed = discord.Embed(title="Success", description=f"Sheet verified with {len(data)} rows", color=discord.Color.green())
+        guilds.bind(interaction.guild_id, link)
+        embed = discord.Embed(title="Success", description=f"Sheet verified with {len(roster)} rows", color=discord.Color.green())
         embed.set_footer(text="CWL Balance Boss")
-        await interaction.followup.send(embed=embed)
-        logging.info(f"Sheet verified: {link}")
+        await followup(interaction, embed=embed)
+        logging.info(f"Sheet verified for server {interaction.guild_id}: {link}")
 
     except Exception as e:
         logging.exception("Error in update_all")
-        await interaction.followup.send(f"Error: {e}")
+        await followup(interaction, f"Error: {e}")
 
-@tree.command(name="profile", description="Show CoC accounts linked to a user", guild=discord.Object(id=1209053585418223646))
+@tree.command(name="profile", description="Show CoC accounts linked to a user")
 @discord.app_commands.describe(user="User to check (defaults to you)")
+@runner.command
 async def profile(interaction: discord.Interaction, user: discord.User = None):
-    if not coc_client:
-        await interaction.response.send_message("CoC API not initialized")
-        return
-    if not sheet_url:
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
         embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         return
     user = user or interaction.user
     discord_id = str(user.id)
-    data = await get_sheet_data(sheet_url)
-    if data is None:
+    roster = await get_sheet_data(state.sheet_url)
+    if roster is None:
         embed = discord.Embed(title="Error", description="Sheet access failed", color=discord.Color.red())
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         return
-    user_accounts = [row for row in data if row['discord_id'] == discord_id]
+    user_accounts = roster.accounts_for(discord_id)
     embed = discord.Embed(title=f"{user.name}'s Profile", color=discord.Color.blue(), timestamp=interaction.created_at)
+    embed.set_footer(text="CWL Balance Boss")
     if not user_accounts:
         embed.description = "No CoC accounts linked"
-    else:
-        try:
-            tags = [row['tag'] for row in user_accounts]
-            players = []
-            async for player in coc_client.get_players(tags):
-                players.append(player)
-            account_list = "\n".join([f"{TOWN_HALL_EMOJIS.get(player.town_hall, '')} {player.name} - ({player.tag})" for player in players])
-            embed.add_field(name="Linked Accounts", value=account_list, inline=False)
-        except Exception as e:
-            embed.description = f"Error: {str(e)}"
-            logging.error(f"Profile error for {discord_id}: {e}")
-    embed.set_footer(text="CWL Balance Boss")
-    await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
+        return
+    embed.description = f"Loading {len(user_accounts)} accounts..."
+    await respond(interaction, embed=embed)
+    players, failed = {}, set()
+    last_edit = time.monotonic()
+    try:
+        async for tag, player, error in player_cache.stream((account.tag for account in user_accounts), state.budget):
+            if error:
+                failed.add(tag)
+                logging.error(f"Profile error for {discord_id} {tag}: {error}")
+            else:
+                players[tag] = player
+            if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL and len(players) + len(failed) < len(user_accounts):
+                set_account_list(embed, user_accounts, players, failed)
+                await edit_response(interaction, embed=embed)
+                last_edit = time.monotonic()
+        embed.description = None
+        set_account_list(embed, user_accounts, players, failed)
+    except Exception as e:
+        embed.description = f"Error: {str(e)}"
+        logging.error(f"Profile error for {discord_id}: {e}")
+    await edit_response(interaction, embed=embed)
+
+def set_account_list(embed, accounts, players, failed):
+    with metrics.span('render_seconds', command='profile'):
+        render_account_list(embed, accounts, players, failed)
+
+def render_account_list(embed, accounts, players, failed):
+    lines = []
+    for account in accounts:
+        player = players.get(account.tag)
+        if player:
+            lines.append(account_line(player))
+        elif account.tag in failed:
+            lines.append(f"{account.name} - ({account.tag}) unavailable")
+    pending = len(accounts) - len(players) - len(failed)
+    if pending:
+        embed.description = f"Loading {pending} more accounts..."
+    embed.clear_fields()
+    add_line_fields(embed, "Linked Accounts", lines)
 
-@tree.command(name="player", description="Show profile of a CoC account by tag", guild=discord.Object(id=1209053585418223646))
+@tree.command(name="player", description="Show profile of a CoC account by tag")
 @discord.app_commands.describe(tag="Player's tag (e.g., #80RY8PVGU)")
+@runner.command
 async def player(interaction: discord.Interaction, tag: str):
-    if not coc_client:
-        await interaction.response.send_message("CoC API not initialized")
-        return
-    if not sheet_url:
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
         embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         return
     tag = tag.strip().upper()
     if not tag.startswith('#'):
         tag = f"#{tag}"
-    data = await get_sheet_data(sheet_url)
-    if data is None:
+    roster = await get_sheet_data(state.sheet_url)
+    if roster is None:
         embed = discord.Embed(title="Error", description="Sheet access failed", color=discord.Color.red())
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         return
-    account = next((row for row in data if row['tag'] == tag), None)
+    account = roster.get(tag)
     embed = discord.Embed(color=discord.Color.green(), timestamp=interaction.created_at)
     if not account:
         embed.title = "Error"
         embed.description = f"No account with tag {tag}"
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         return
     try:
-        player = await coc_client.get_player(tag)
-        embed.title = f"{player.name} - {player.tag}"
-        league_emoji = next(emoji for (min_trophies, max_trophies), emoji in TROPHY_LEAGUE_EMOJIS.items() if min_trophies <= player.trophies <= max_trophies)
-        clan_info = "Clan: No Clan"
-        if player.clan:
-            clan_tag = player.clan.tag.lstrip('#')
-            clan_info = f"[Clan: {player.clan.name}](https://link.clashofclans.com/en?action=OpenClanProfile&tag={clan_tag})"
-        member_info = (
-            f"{TOWN_HALL_EMOJIS.get(player.town_hall, '')} Town Hall: {player.town_hall}\n"
-            f"<:Icon_Clan:1371824433492135966> {clan_info}\n"
-            f"{league_emoji} Trophies: {player.trophies}"
-        )
-        embed.add_field(name="Member Info", value=member_info, inline=False)
-        heroes = {hero.name: hero.level for hero in player.heroes}
-        hero_display = [f"{emoji} {heroes[hero_name]}" for hero_name, emoji in HERO_EMOJIS.items() if hero_name in heroes]
-        hero_value = "  ".join(hero_display) if hero_display else "None"
-        embed.add_field(name="Hero Levels", value=hero_value, inline=False)
-        expected_hero_levels = {
-            7: {'Barbarian King': 5},
-            9: {'Barbarian King': 30, 'Archer Queen': 30},
-            11: {'Barbarian King': 50, 'Archer Queen': 50, 'Grand Warden': 20},
-            13: {'Barbarian King': 75, 'Archer Queen': 75, 'Grand Warden': 50, 'Royal Champion': 25},
-            15: {'Barbarian King': 85, 'Archer Queen': 85, 'Grand Warden': 60, 'Royal Champion': 35},
-            17: {'Barbarian King': 95, 'Archer Queen': 95, 'Grand Warden': 70, 'Royal Champion': 45, 'Minion Prince': 20}
-        }
-        rush_scores = []
-        th_level = player.town_hall
-        for th, levels in sorted(expected_hero_levels.items(), reverse=True):
-            if th_level >= th:
-                for hero_name, expected_level in levels.items():
-                    if hero_name in heroes:
-                        actual_level = heroes[hero_name]
-                        rush_score = max(0, (expected_level - actual_level) / expected_level)
-                        rush_scores.append(rush_score)
-                break
-        rushed_percentage = (sum(rush_scores) / len(rush_scores) * 100) if rush_scores else 0
-        embed.add_field(name="Rushed Percentage", value=f"Rushed: {rushed_percentage:.2f}%", inline=False)
-        discord_info = f"<@{account['discord_id']}>" if account['discord_id'] else "Not linked"
-        embed.add_field(name="Discord Username", value=discord_info, inline=False)
-        embed.set_footer(text="CWL Balance Boss")
-        await interaction.response.send_message(embed=embed)
+        player = await player_cache.get_player(tag, state.budget)
+        with metrics.span('render_seconds', command='player'):
+            embed.title = f"{player.name} - {player.tag}"
+            embed.add_field(name="Member Info", value=member_info(player), inline=False)
+            embed.add_field(name="Hero Levels", value=hero_line(player), inline=False)
+            embed.add_field(name="Rushed Percentage", value=rush_summary(player), inline=False)
+            discord_info = f"<@{account.discord_id}>" if account.discord_id else "Not linked"
+            embed.add_field(name="Discord Username", value=discord_info, inline=False)
+            embed.set_footer(text="CWL Balance Boss")
+        await respond(interaction, embed=embed)
     except Exception as e:
         embed.title = "Error"
         embed.description = f"Failed to fetch player: {str(e)}"
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
         logging.error(f"Player error {tag}: {e}")
 
-@tree.command(name="claninfo", description="Fetch CoC clan info", guild=discord.Object(id=1209053585418223646))
+@tree.command(name="claninfo", description="Fetch CoC clan info")
 @discord.app_commands.describe(clan_tag="Clan tag (e.g., #2L2Q0V2L)")
+@runner.command
 async def claninfo(interaction: discord.Interaction, clan_tag: str):
-    if not coc_client:
-        await interaction.response.send_message("CoC API not initialized")
-        return
     try:
         clan_tag = coc.utils.correct_tag(clan_tag)
-        clan = await coc_client.get_clan(clan_tag)
+        clan = await player_cache.get_clan(clan_tag, guilds.get(interaction.guild_id).budget)
         embed = discord.Embed(title=clan.name, description=clan.description, color=discord.Color.blue())
         embed.add_field(name="Tag", value=clan.tag)
         embed.add_field(name="Level", value=clan.level)
         embed.add_field(name="Members", value=f"{len(clan.members)}/50")
         embed.add_field(name="League", value=clan.war_league.name)
         embed.set_footer(text="CWL Balance Boss")
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, embed=embed)
     except Exception as e:
-        await interaction.response.send_message(f"Clan error: {e}")
+        await respond(interaction, f"Clan error: {e}")
         logging.error(f"Clan error: {e}")
 
+async def load_clan_report(state, roster, clan_tag):
+    clan = await player_cache.get_clan(clan_tag, state.budget)
+    players = {tag: player async for tag, player, error in player_cache.stream([member.tag for member in clan.members], state.budget) if player}
+    return clan_report(clan, roster, players)
+
+@tree.command(name="clanreport", description="CWL readiness of a clan, checked against the roster sheet")
+@discord.app_commands.describe(clan_tag="Clan tag (e.g., #2L2Q0V2L)", as_csv="Attach the full report as a CSV file instead of embeds")
+@runner.command
+async def clanreport(interaction: discord.Interaction, clan_tag: str, as_csv: bool = False):
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
+        embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
+        await respond(interaction, embed=embed)
+        return
+    await defer(interaction)
+    try:
+        roster = await get_sheet_data(state.sheet_url)
+        if roster is None:
+            embed = discord.Embed(title="Error", description="Sheet access failed", color=discord.Color.red())
+            await followup(interaction, embed=embed)
+            return
+        clan_tag = coc.utils.correct_tag(clan_tag)
+        report = await runner.coalesce(('clanreport', state.sheet_id, clan_tag), lambda: offload('clanreport', interaction.guild_id, roster, clan_tag))
+        clan = report.clan
+        with metrics.span('render_seconds', command='clanreport'):
+            description = f"{len(report.members)} members, average rush {report.average_rush:.1f}%"
+            if report.failed:
+                description += f"\n{len(report.failed)} members could not be fetched"
+            if as_csv:
+                attachment = discord.File(io.BytesIO(report.to_csv().encode()), filename=f"clanreport-{clan.tag.lstrip('#')}.csv")
+                embed = discord.Embed(title=f"{clan.name} - CWL Report", description=description, color=discord.Color.blue())
+                embed.set_footer(text="CWL Balance Boss")
+                await followup(interaction, embed=embed, file=attachment)
+                return
+            fields = [
+                ("Town Halls", "  ".join(f"{(town_hall_emoji(th) or f'TH{th}')} {count}" for th, count in report.town_halls.items()) or "None"),
+                ("Hero Totals", "\n".join(f"{HERO_EMOJIS.get(hero, hero)} {total} ({count} members, avg {total / count:.0f})" for hero, (total, count) in report.hero_totals.items()) or "None"),
+            ]
+            members = sorted(report.members, key=lambda row: (-row.town_hall, row.rush if not math.isnan(row.rush) else 100))
+            lines = [
+                f"{town_hall_emoji(row.town_hall)} {row.name} ({row.tag}) - " + ("no data" if math.isnan(row.rush) else f"rushed {row.rush:.1f}%")
+                for row in members
+            ]
+            fields.append(("Members", join_lines(lines)))
+            fields.append((f"In sheet but not in clan - {len(report.in_sheet_not_clan)}", join_lines([f"{row.name} ({row.tag}) <@{row.owner}>" for row in report.in_sheet_not_clan])))
+            fields.append((f"In clan but not in sheet - {len(report.in_clan_not_sheet)}", join_lines([
+                f"{row.name} ({row.tag})" + (f" - sheet has {row.sheet_clan or 'no clan'}" if row.owner else "")
+                for row in report.in_clan_not_sheet
+            ])))
+            pages = build_pages(f"{clan.name} - CWL Report", discord.Color.blue(), description, fields)
+        for embed in pages:
+            await followup(interaction, embed=embed)
+    except Exception as e:
+        logging.exception("Error in clanreport")
+        await followup(interaction, f"Clan report error: {e}")
+
+async def plan_balance(state, roster, clans, size, one_per_owner, pinned):
+    targets = []
+    for clan_tag in dict.fromkeys(coc.utils.correct_tag(tag) for tag in clans.split(',') if tag.strip()):
+        clan = await player_cache.get_clan(clan_tag, state.budget)
+        league = clan.war_league.name if clan.war_league else 'Unranked'
+        targets.append(ClanTarget(clan.tag, clan.name, size, LEAGUE_TARGETS.get(league, LEAGUE_TARGETS['Unranked'])))
+    if not targets:
+        return None
+    clan_keys = {key: target.tag for target in targets for key in (target.tag.upper(), target.name.upper())}
+    pinned_tags = {coc.utils.correct_tag(tag) for tag in pinned.split(',') if tag.strip()}
+    players = [player async for tag, player, error in player_cache.stream(roster.tags, state.budget) if player]
+    scores = score_roster(players)
+    performance = war_tracker.log.performance(WAR_SEASONS)
+    # Accounts whose fetch failed count as rushed as the roster's median, not as fully developed
+    unknown_rush = float(statistics.median(scores.rush)) if len(scores) else UNKNOWN_RUSH
+    members = []
+    for account in roster:
+        if account.tag in scores:
+            index = scores.index(account.tag)
+            name, town_hall, account_strength = players[index].name, int(scores.town_hall[index]), float(scores.strength[index])
+        else:
+            name, town_hall, account_strength = account.name, account.town_hall, strength(account.town_hall, unknown_rush)
+        account_strength = war_adjusted(account_strength, performance.get(account.tag, PRIOR_STARS))
+        pin = clan_keys.get(account.clan.upper()) if account.tag in pinned_tags else None
+        members.append(BalanceMember(account.tag, name, account.discord_id, town_hall, account_strength, pin))
+    result = await asyncio.to_thread(balance, members, targets, 1 if one_per_owner else None)
+    metrics.observe('balance_solve_seconds', result.elapsed)
+    return result
+
+# Bulk jobs, run here or in a worker process; arguments and results are plain picklable objects
+async def clan_report_job(guild_id, roster, clan_tag):
+    return (await load_clan_report(guilds.get(guild_id), roster, clan_tag)).detached()
+
+async def balance_job(guild_id, roster, clans, size, one_per_owner, pinned):
+    if not war_tracker.running:
+        # Workers do not poll wars themselves; pick up what the gateway has saved
+        await war_tracker.load()
+    return await plan_balance(guilds.get(guild_id), roster, clans, size, one_per_owner, pinned)
+
+async def sync_sheet_job(guild_id, sheet_id, heroes, dry_run):
+    return await sync_roster(sheets_io, player_cache, sheet_id, guilds.get(guild_id).budget, heroes, dry_run)
+
+WORKER_JOBS = {'clanreport': clan_report_job, 'balance': balance_job, 'sync_sheet': sync_sheet_job}
+workers = WorkerPool(socket_paths(BOT_WORKERS, os.getenv('BOT_WORKER_DIR')), timeout=float(os.getenv('WORKER_TIMEOUT', 120))) if BOT_WORKERS else None
+if workers:
+    metrics.register('workers', lambda: workers.stats)
+
+async def offload(job, guild_id, *args):
+    """Run a bulk job in the guild's worker process in split mode, or in this process otherwise."""
+    if workers:
+        try:
+            return await workers.call(job, guild_id, *args, key=guild_id)
+        except ConnectionError as e:
+            metrics.incr('worker_fallbacks', job=job)
+            logging.warning(f"Worker unavailable for {job}, running it here: {e}")
+    return await WORKER_JOBS[job](guild_id, *args)
+
+@tree.command(name="balance", description="Split the roster across clans by strength")
+@discord.app_commands.describe(
+    clans="Clan tags to fill, comma separated",
+    size="CWL lineup size per clan",
+    one_per_owner="At most one account per Discord member in each clan",
+    pinned="Tags to keep in their sheet CLAN, comma separated"
+)
+@discord.app_commands.choices(size=[discord.app_commands.Choice(name="15", value=15), discord.app_commands.Choice(name="30", value=30)])
+@runner.command
+async def balance_command(interaction: discord.Interaction, clans: str, size: int = 15, one_per_owner: bool = True, pinned: str = ""):
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
+        embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
+        await respond(interaction, embed=embed)
+        return
+    await defer(interaction)
+    try:
+        roster = await get_sheet_data(state.sheet_url)
+        if roster is None:
+            embed = discord.Embed(title="Error", description="Sheet access failed", color=discord.Color.red())
+            await followup(interaction, embed=embed)
+            return
+        key = ('balance', state.sheet_id, clans.upper().replace(' ', ''), size, one_per_owner, pinned.upper().replace(' ', ''))
+        result = await runner.coalesce(key, lambda: offload('balance', interaction.guild_id, roster, clans, size, one_per_owner, pinned))
+        if result is None:
+            await followup(interaction, "No clan tags given")
+            return
+
+        with metrics.span('render_seconds', command='balance'):
+            fields = []
+            for target, lineup in zip(result.clans, result.lineups):
+                avg_th = sum(member.town_hall for member in lineup) / len(lineup) if lineup else 0
+                avg_strength = sum(member.strength for member in lineup) / len(lineup) if lineup else 0
+                lines = [f"{town_hall_emoji(member.town_hall)} {member.name} ({member.tag})" for member in lineup]
+                fields.append((f"{target.name} - {len(lineup)}/{target.size} - TH {avg_th:.1f} - strength {avg_strength:.2f}/{target.target:.1f}", join_lines(lines)))
+            if result.bench:
+                fields.append((f"Bench - {len(result.bench)}", join_lines([f"{member.name} ({member.tag})" for member in result.bench])))
+            if result.overflow:
+                lines = [f"{member.name} ({member.tag})" for member in result.overflow]
+                fields.append((f"Pins benched (clan full or owner already there) - {len(result.overflow)}", join_lines(lines)))
+            description = f"{len(roster)} accounts across {len(result.clans)} clans ({result.elapsed * 1000:.0f} ms)"
+            pages = build_pages("CWL Balance", discord.Color.gold(), description, fields)
+        for embed in pages:
+            await followup(interaction, embed=embed)
+    except Exception as e:
+        logging.exception("Error in balance")
+        await followup(interaction, f"Balance error: {e}")
+
+@tree.command(name="warstats", description="CWL attack history of a member's accounts or a single tag")
+@discord.app_commands.describe(user="Member to show (defaults to you)", tag="Single account tag instead of a member", seasons="Only count the most recent seasons (1-24)")
+@runner.command
+async def warstats(interaction: discord.Interaction, user: discord.User = None, tag: str = None, seasons: discord.app_commands.Range[int, 1, 24] = None):
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
+        embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
+        await respond(interaction, embed=embed)
+        return
+    roster = await get_sheet_data(state.sheet_url)
+    if roster is None:
+        embed = discord.Embed(title="Error", description="Sheet access failed", color=discord.Color.red())
+        await respond(interaction, embed=embed)
+        return
+    if tag:
+        tag = coc.utils.correct_tag(tag)
+        accounts = [roster.get(tag)] if tag in roster else []
+        title = f"War Stats - {tag}"
+    else:
+        user = user or interaction.user
+        accounts = roster.accounts_for(user.id)
+        title = f"{user.name}'s War Stats"
+    with metrics.span('render_seconds', command='warstats'):
+        summary = war_tracker.log.summary(seasons or WAR_SEASONS)
+        lines = []
+        for account in accounts:
+            attacks, stars, destruction, triples = summary.get(account.tag, (0, 0, 0.0, 0))
+            line = f"{town_hall_emoji(account.town_hall)} {account.name} ({account.tag}) - "
+            if attacks:
+                line += f"{attacks} attacks, {stars / attacks:.2f} stars avg, {destruction:.0f}% avg, {triples} triples"
+            else:
+                line += "no attacks tracked"
+            lines.append(line)
+        embed = discord.Embed(title=title, color=discord.Color.orange(), timestamp=interaction.created_at)
+        embed.description = f"Last {seasons or WAR_SEASONS} CWL seasons, {len(war_tracker.log)} attacks tracked"
+        add_line_fields(embed, "Accounts", lines or ["No linked accounts"])
+        embed.set_footer(text="CWL Balance Boss")
+    await respond(interaction, embed=embed)
+
+@tree.command(name="sync_sheet", description="Write live names, town halls and optional hero/rush columns back to the sheet")
+@discord.app_commands.describe(heroes="Also fill hero level and Rush % columns the sheet has", dry_run="Only report what would change")
+@discord.app_commands.default_permissions(administrator=True)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@runner.command
+async def sync_sheet(interaction: discord.Interaction, heroes: bool = True, dry_run: bool = False):
+    if not coc_client:
+        await respond(interaction, f"CoC API not available ({startup.status('coc')}), try again shortly.", ephemeral=True)
+        return
+    state = guilds.get(interaction.guild_id)
+    if not state.sheet_url:
+        embed = discord.Embed(title="Error", description="Run /update_all first", color=discord.Color.red())
+        await respond(interaction, embed=embed)
+        return
+    await defer(interaction)
+    try:
+        result = await runner.coalesce(
+            ('sync_sheet', state.sheet_id, heroes, dry_run),
+            lambda: offload('sync_sheet', interaction.guild_id, state.sheet_id, heroes, dry_run)
+        )
+        if not result.cells:
+            description = "Sheet already matches the game data; nothing written."
+        elif dry_run:
+            description = f"{len(result.cells)} cells in {result.rows} rows would change."
+        else:
+            description = f"Updated {len(result.cells)} cells in {result.rows} rows with {result.calls} write calls."
+        embed = discord.Embed(title="Sheet Sync", description=description, color=discord.Color.green())
+        embed.add_field(name="Accounts", value=f"{result.fetched}/{result.tags} fetched", inline=False)
+        embed.add_field(name="Columns", value=", ".join(result.columns) or "None", inline=False)
+        if result.cells:
+            add_line_fields(embed, "Changes", [f"Row {row} {header}: {value}" for row, header, value in result.cells])
+        embed.set_footer(text="CWL Balance Boss")
+        await followup(interaction, embed=embed)
+        logging.info(f"Sheet sync for server {interaction.guild_id}: {len(result.cells)} cells, {result.calls} calls, dry_run={dry_run}")
+    except Exception as e:
+        logging.exception("Error in sync_sheet")
+        await followup(interaction, f"Sheet sync error: {e}")
+
+@tree.command(name="stats", description="Show per-command latency and cache statistics")
+@discord.app_commands.default_permissions(administrator=True)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@runner.command
+async def stats(interaction: discord.Interaction):
+    fields = []
+    for name, title in (
+        ('command_seconds', "Commands"),
+        ('get_sheet_data_seconds', "Sheet reads"),
+        ('sheets_call_seconds', "Sheets API calls"),
+        ('coc_request_seconds', "CoC API calls"),
+        ('render_seconds', "Embed rendering"),
+        ('discord_send_seconds', "Discord sends"),
+    ):
+        lines = []
+        for labels, (count, quantiles) in metrics.summary(name).items():
+            label = ", ".join(str(value) for _, value in labels) or "all"
+            lines.append(f"`{label}` p50 {quantiles[0.5] * 1000:.0f} / p95 {quantiles[0.95] * 1000:.0f} / p99 {quantiles[0.99] * 1000:.0f} ms ({count})")
+        if lines:
+            fields.append((title, join_lines(lines)))
+    counters = [f"`{name}{dict(labels) if labels else ''}` {value}" for (name, labels), value in sorted(metrics.counters.items())]
+    counters += [f"`{name}` {value:.2f}" if isinstance(value, float) else f"`{name}` {value}" for name, value in metrics.collected().items()]
+    fields.append(("Counters", join_lines(counters)))
+    fields.append(("Startup", join_lines([f"`{name}` {startup.status(name)}" for name in startup.subsystems])))
+    await asyncio.to_thread(metrics.write_prometheus, METRICS_FILE)
+    pages = build_pages("Bot Stats", discord.Color.blurple(), f"Exported to {METRICS_FILE}", fields)
+    await respond(interaction, embed=pages[0], ephemeral=True)
+    for page in pages[1:]:
+        await followup(interaction, embed=page, ephemeral=True)
+
+def roster_choices(interaction, current):
+    state = guilds.get(interaction.guild_id)
+    index = account_index(state.sheet_id) if state.sheet_url else None
+    if index is None:
+        if state.sheet_url:
+            # Nothing in memory yet: load the roster in the background for the next keystroke, never wait on it here
+            asyncio.ensure_future(get_sheet_data(state.sheet_url))
+        return []
+    own = [account.tag for account in roster_cache.peek(state.sheet_id).roster.accounts_for(interaction.user.id)]
+    return index.search(current, prefer=own)
+
+@player.autocomplete('tag')
+@warstats.autocomplete('tag')
+async def tag_autocomplete(interaction: discord.Interaction, current: str):
+    with metrics.span('autocomplete_seconds', param='tag'):
+        return [discord.app_commands.Choice(name=label, value=value) for label, value in roster_choices(interaction, current)]
+
+@claninfo.autocomplete('clan_tag')
+@clanreport.autocomplete('clan_tag')
+async def clan_tag_autocomplete(interaction: discord.Interaction, current: str):
+    with metrics.span('autocomplete_seconds', param='clan_tag'):
+        return [discord.app_commands.Choice(name=label, value=value) for label, value in clan_index.search(current, prefer=WAR_CLANS)]
+
+async def shutdown():
+    startup.stop()
+    update_feed.stop()
+    prefetcher.stop()
+    war_tracker.stop()
+    if coc_client is not None:
+        await coc_client.close()
+    sheets_io.close()
+    if store:
+        store.close()
+    logging.info(f"Player cache stats: {player_cache.stats}")
+
 async def main():
     try:
         logging.info("Starting bot...")
+        if workers:
+            # Workers read the key share from the environment they inherit
+            os.environ['COC_PROCESSES'] = str(COC_PROCESSES)
+            workers.spawn()
+        # Sheets auth and CoC login overlap with the Discord login instead of waiting for on_ready
+        start_subsystems()
+        await guilds.load()
         await client.start(DISCORD_TOKEN)
     except Exception as e:
         logging.error(f"Bot start error: {e}")
+    finally:
+        if workers:
+            await workers.close()
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
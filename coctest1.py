@@ -9,11 +9,10 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import re
 
-# Setup logging to discord.log
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.getLogger('').addHandler(handler)
-logging.getLogger('').setLevel(logging.INFO)
+from logsetup import setup_logging
+
+# Log to discord.log (appending, rotated) and events.jsonl through the logging queue
+setup_logging()
 
 # Emoji mappings
 HERO_EMOJIS = {
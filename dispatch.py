@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+
+from metrics import metrics
+
+
+def _response_lock(interaction):
+    lock = interaction.extras.get('response_lock')
+    if lock is None:
+        lock = interaction.extras['response_lock'] = asyncio.Lock()
+    return lock
+
+
+async def send(interaction, *args, **kwargs):
+    """Send the initial response, or a followup once the interaction has been responded to or deferred."""
+    async with _response_lock(interaction):
+        if not interaction.response.is_done():
+            await interaction.response.send_message(*args, **kwargs)
+            return
+    await interaction.followup.send(*args, **kwargs)
+
+
+async def defer(interaction, **kwargs):
+    """Defer unless something already responded."""
+    async with _response_lock(interaction):
+        if not interaction.response.is_done():
+            await interaction.response.defer(**kwargs)
+
+
+class _Slots:
+    """Lazily created semaphores per key, dropped again once nobody holds or waits on them."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._slots.get(key)
+        if entry is None:
+            entry = self._slots[key] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._slots[key]
+
+
+class CommandRunner:
+    """Admission control for slash command handlers.
+
+    At most `max_pending` commands are queued or running at once; beyond that
+    the user is told the bot is busy instead of the command piling up. Each
+    user and each guild has its own concurrency limit, and `max_running`
+    bounds the total. Interactions that have not been answered `defer_after`
+    seconds after they arrived are deferred so Discord's 3-second window never
+    expires while a command waits or works. Handlers can share the result of
+    identical in-flight work through `coalesce`.
+    """
+
+    def __init__(self, max_running=16, max_pending=64, per_user=2, per_guild=8, defer_after=2.0):
+        self.max_pending = max_pending
+        self.defer_after = defer_after
+        self.pending = 0
+        self.running = 0
+        self._running = asyncio.Semaphore(max_running)
+        self._users = _Slots(per_user)
+        self._guilds = _Slots(per_guild)
+        self._coalesced = {}
+
+    @property
+    def stats(self):
+        return {'pending': self.pending, 'running': self.running, 'coalescing': len(self._coalesced)}
+
+    def command(self, func):
+        """Run a command callback under the runner's limits; use below `@tree.command`."""
+
+        @functools.wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            name = func.__name__
+            if self.pending >= self.max_pending:
+                metrics.incr('commands_rejected', command=name)
+                logging.warning(f"Rejected {name} for {interaction.user.id}: {self.pending} commands pending")
+                await send(interaction, "The bot is busy right now, please try again in a few seconds.", ephemeral=True)
+                return
+            self.pending += 1
+            started = interaction.extras.get('started') or time.perf_counter()
+            deferrer = asyncio.ensure_future(self._auto_defer(interaction, started))
+            try:
+                # Narrowest limit first, so a command queued behind its own user's slot holds no guild or global slot
+                async with self._users.hold(interaction.user.id), self._guilds.hold(interaction.guild_id), self._running:
+                    metrics.observe('command_queue_seconds', time.perf_counter() - started, command=name)
+                    self.running += 1
+                    try:
+                        return await func(interaction, *args, **kwargs)
+                    finally:
+                        self.running -= 1
+            finally:
+                self.pending -= 1
+                deferrer.cancel()
+
+        return wrapper
+
+    async def _auto_defer(self, interaction, started):
+        await asyncio.sleep(max(0.0, self.defer_after - (time.perf_counter() - started)))
+        if not interaction.response.is_done():
+            metrics.incr('commands_auto_deferred')
+            try:
+                await defer(interaction)
+            except Exception as e:
+                logging.warning(f"Auto-defer failed: {e}")
+
+    async def coalesce(self, key, make_coro):
+        """Await `make_coro()`, sharing one run between concurrent callers with the same key."""
+        task = self._coalesced.get(key)
+        if task is None:
+            task = self._coalesced[key] = asyncio.ensure_future(make_coro())
+            task.add_done_callback(lambda _: self._coalesced.pop(key, None))
+        else:
+            metrics.incr('commands_coalesced', command=str(key[0]))
+        return await asyncio.shield(task)
+
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import random
+import time
+
+import coc
+
+from metrics import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class NotConnected(coc.errors.ClashOfClansException):
+    """The API client has not logged in yet (or its login is still being retried)."""
+
+
+class PlayerFetcher:
+    """Batch player fetches on top of a coc.Client.
+
+    Requests run with bounded concurrency behind a token bucket sized to the
+    API key limits, 429/5xx responses are retried with jittered exponential
+    backoff, and a tag that is already being fetched is shared rather than
+    requested twice.
+    """
+
+    def __init__(self, client=None, concurrency=10, rate=30.0, burst=None, retries=3, backoff=0.5, connect_wait=5.0):
+        self.client = client
+        self.connect_wait = connect_wait
+        self._connected = asyncio.Event()
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight = {}
+
+    def resize(self, concurrency, rate, burst=None):
+        """Resize the limits, e.g. once a client pool reports how many keys it has."""
+        self.bucket = TokenBucket(rate, burst)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _request(self, func, *args):
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                await self.bucket.acquire()
+                try:
+                    with metrics.span('coc_request_seconds', endpoint=func.__name__):
+                        return await func(*args)
+                except coc.errors.HTTPException as e:
+                    if e.status == 429:
+                        metrics.incr('coc_rate_limited', endpoint=func.__name__)
+                    retryable = isinstance(e, (coc.errors.Maintenance, coc.errors.GatewayError)) or e.status in RETRY_STATUSES
+                    if not retryable or attempt == self.retries:
+                        metrics.incr('coc_errors', endpoint=func.__name__)
+                        raise
+                    metrics.incr('coc_retries', endpoint=func.__name__)
+                    delay = self.backoff * 2 ** attempt * (1 + random.random())
+                    logging.warning(f"CoC request {func.__name__}{args} failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def _shared(self, key, func, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(func, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def attach(self, client):
+        """Start serving requests through `client` once it has logged in."""
+        self.client = client
+        self._connected.set()
+
+    async def _method(self, name):
+        if self.client is None:
+            # Requests that arrive while the login is still running wait for it briefly
+            try:
+                await asyncio.wait_for(self._connected.wait(), self.connect_wait)
+            except asyncio.TimeoutError:
+                raise NotConnected("CoC API is not connected yet") from None
+        return getattr(self.client, name)
+
+    async def get_player(self, tag):
+        return await self._shared(('player', tag), await self._method('get_player'), tag)
+
+    async def get_clan(self, tag):
+        return await self._shared(('clan', tag), await self._method('get_clan'), tag)
+
+    async def get_league_group(self, clan_tag):
+        return await self._shared(('league_group', clan_tag), await self._method('get_league_group'), clan_tag)
+
+    async def get_league_war(self, war_tag):
+        return await self._shared(('league_war', war_tag), await self._method('get_league_war'), war_tag)
+
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from fetcher import TokenBucket
+from sheets import parse_sheet_id
+
+
+class GuildState:
+    """Everything one Discord server owns: its roster sheet and its share of the API budget."""
+
+    __slots__ = ('guild_id', 'sheet_url', 'budget')
+
+    def __init__(self, guild_id, rate):
+        self.guild_id = guild_id
+        self.sheet_url = None
+        self.budget = TokenBucket(rate)
+
+    @property
+    def sheet_id(self):
+        return parse_sheet_id(self.sheet_url) if self.sheet_url else None
+
+
+class GuildRegistry:
+    """Per-guild state, created on first use.
+
+    Roster snapshots are keyed by sheet ID, so each guild only ever sees its
+    own sheet. Player and clan data stay in the shared caches because the API
+    returns the same data whichever guild asks; what keeps guilds isolated
+    there is each guild's own token bucket for the API calls it triggers.
+
+    Sheet bindings are saved to the optional `store` (cache.SqliteTier) so
+    they survive restarts.
+    """
+
+    def __init__(self, rate=10.0, store=None):
+        self.rate = rate
+        self.store = store
+        self._states = {}
+
+    async def load(self):
+        """Restore saved sheet bindings."""
+        if not self.store:
+            return
+        for guild_id, sheet_url in (await self.store.get_bindings()).items():
+            self.get(guild_id).sheet_url = sheet_url
+        logging.info(f"Restored sheet bindings for {len(self._states)} servers")
+
+    def bind(self, guild_id, sheet_url):
+        state = self.get(guild_id)
+        state.sheet_url = sheet_url
+        if self.store:
+            task = asyncio.ensure_future(self.store.put_binding(guild_id, sheet_url))
+            task.add_done_callback(self._log_failure)
+        return state
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"Saving sheet binding failed: {task.exception()}")
+
+    def get(self, guild_id):
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = GuildState(guild_id, self.rate)
+        return state
+
+    def __iter__(self):
+        return iter(self._states.values())
+
+    def sheet_ids(self):
+        return list(dict.fromkeys(state.sheet_id for state in self._states.values() if state.sheet_id))
@@ -0,0 +1,138 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+# Structured fields commands attach through `extra=`; copied into JSON events when present
+EVENT_FIELDS = ('event', 'command', 'guild', 'user', 'tag', 'status', 'latency_ms')
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Share of INFO/DEBUG records kept per logger; warnings and errors are always kept
+DEFAULT_SAMPLE_RATES = {'discord.gateway': 0.1, 'discord.client': 0.25, 'cwl.events': 1.0}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, any EVENT_FIELDS and the traceback."""
+
+    def format(self, record):
+        event = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if record.exc_text:
+            event['exc'] = record.exc_text
+        return json.dumps(event, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a share of low-severity records from noisy loggers, matched by name prefix."""
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first so 'discord.gateway' wins over 'discord'
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return rate >= 1.0 or random.random() < rate
+        return True
+
+
+class RotatingHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that also rolls over once the file has been open for `interval` seconds."""
+
+    def __init__(self, filename, max_bytes, backup_count, interval=86400.0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+class EventQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that renders the message and traceback up front but keeps the structured fields."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def setup_logging(text_path='discord.log', json_path='events.jsonl', level=logging.INFO, max_bytes=5_000_000, backup_count=5, interval=86400.0, sample_rates=None):
+    """Route all logging through a queue so file writes happen on a listener thread, never on the event loop.
+
+    Records go to a human-readable text log and a JSON-lines event log, both
+    rotated by size and age. Low-severity records from noisy loggers are
+    sampled before they are queued.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    handlers = []
+    if text_path:
+        text = RotatingHandler(text_path, max_bytes, backup_count, interval)
+        text.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(text)
+    if json_path:
+        events = RotatingHandler(json_path, max_bytes, backup_count, interval)
+        events.setFormatter(JsonFormatter())
+        handlers.append(events)
+    log_queue = queue.SimpleQueue()
+    queue_handler = EventQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(dict(DEFAULT_SAMPLE_RATES, **(sample_rates or {}))))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def sample_rates_from_env(value):
+    """Parse `logger=rate,logger=rate` (e.g. from LOG_SAMPLE_RATES)."""
+    rates = {}
+    for item in (value or '').split(','):
+        name, _, rate = item.strip().partition('=')
+        if name and rate:
+            rates[name] = float(rate)
+    return rates
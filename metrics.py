@@ -0,0 +1,116 @@
+import contextlib
+import os
+import time
+from collections import deque
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Latency samples kept in a bounded window, plus lifetime count and sum."""
+
+    __slots__ = ('samples', 'count', 'total')
+
+    def __init__(self, window=2048):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    """Process-wide timing histograms and counters, keyed by name and labels."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = {}
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def incr(self, name, value=1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block (awaits included) into the `name` histogram."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register(self, prefix, collector):
+        """Include the numeric values of `collector()` (a dict) as `<prefix>_<key>` in every export."""
+        self.collectors[prefix] = collector
+
+    def collected(self):
+        values = {}
+        for prefix, collector in self.collectors.items():
+            for key, value in collector().items():
+                values[f'{prefix}_{key}'] = value
+        return values
+
+    def summary(self, name):
+        """`{labels: (count, {quantile: seconds})}` for every histogram called `name`."""
+        return {
+            labels: (histogram.count, histogram.quantiles())
+            for (metric, labels), histogram in sorted(self.histograms.items())
+            if metric == name
+        }
+
+    def prometheus(self):
+        lines = []
+        for name in sorted({metric for metric, _ in self.histograms}):
+            lines.append(f'# TYPE cwl_{name} summary')
+            for labels, histogram in ((l, h) for (m, l), h in sorted(self.histograms.items()) if m == name):
+                for q, value in histogram.quantiles().items():
+                    lines.append(f'cwl_{name}{_format_labels(labels, [("quantile", q)])} {value:.6f}')
+                lines.append(f'cwl_{name}_sum{_format_labels(labels)} {histogram.total:.6f}')
+                lines.append(f'cwl_{name}_count{_format_labels(labels)} {histogram.count}')
+        for name in sorted({metric for metric, _ in self.counters}):
+            lines.append(f'# TYPE cwl_{name}_total counter')
+            for (metric, labels), value in sorted(self.counters.items()):
+                if metric == name:
+                    lines.append(f'cwl_{name}_total{_format_labels(labels)} {value}')
+        for name, value in sorted(self.collected().items()):
+            lines.append(f'# TYPE cwl_{name} gauge')
+            lines.append(f'cwl_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Write to a temp file and rename so scrapers never read a half-written file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
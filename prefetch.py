@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import logging
+import random
+
+import coc
+
+from fetcher import TokenBucket
+
+# Refresh interval in seconds for each phase of the monthly CWL cycle
+DEFAULT_INTERVALS = {'signup': 300.0, 'war': 600.0, 'idle': 3600.0}
+
+
+def cwl_phase(now=None):
+    """Where the month is in the CWL cycle: sign-up on days 1-2, war days 3-11 (UTC), idle otherwise."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if now.day <= 2:
+        return 'signup'
+    if now.day <= 11:
+        return 'war'
+    return 'idle'
+
+
+class PrefetchScheduler:
+    """Background task that keeps the roster, linked players and their clans warm in the caches.
+
+    Each round re-reads the roster snapshot, then refreshes players and clans
+    (their own plus any from the optional `clan_tags()`) whose cache entry
+    would expire before the next round. Refreshed entries keep the cache's
+    normal TTL, so commands never take hour-old data for fresh; between
+    rounds they are served stale and refreshed on demand as usual.
+    Refreshes run `batch_size` at a time and draw on their own token bucket,
+    well below the key's limit, so interactive commands always have headroom.
+    Since every refresh goes through the player cache, its listeners see each
+    change as it is polled. Rounds are spaced by the current CWL phase with
+    random jitter so several bots do not line up.
+    """
+
+    def __init__(self, roster_cache, player_cache, sheet_ids, rate=5.0, intervals=None, jitter=0.2, clan_tags=None, batch_size=20):
+        self.roster_cache = roster_cache
+        self.player_cache = player_cache
+        self.sheet_ids = sheet_ids
+        self.clan_tags = clan_tags
+        self.batch_size = batch_size
+        self.budget = TokenBucket(rate)
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.jitter = jitter
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+            logging.info("Prefetch scheduler started")
+
+    def stop(self):
+        if self.running:
+            self._task.cancel()
+
+    def next_interval(self):
+        interval = self.intervals[cwl_phase()]
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Prefetch round failed: {e}")
+            await asyncio.sleep(self.next_interval())
+
+    async def refresh(self):
+        # Anything that would expire before the longest possible gap to the next round is due
+        horizon = self.intervals[cwl_phase()] * (1 + self.jitter)
+        player_tags = {}
+        for sheet_id in self.sheet_ids():
+            # One unreachable sheet must not cost every other guild its round
+            try:
+                snapshot = await self.roster_cache.get(sheet_id)
+            except Exception as e:
+                logging.warning(f"Prefetch skipped roster {sheet_id}: {e}")
+                continue
+            player_tags.update(dict.fromkeys(snapshot.roster.tags))
+        refreshed = await self._refresh_due('player', player_tags, horizon)
+        clan_tags = set(self.clan_tags()) if self.clan_tags else set()
+        for tag in player_tags:
+            player = self.player_cache.peek('player', tag)
+            if player is not None and player.clan:
+                clan_tags.add(player.clan.tag)
+        refreshed += await self._refresh_due('clan', clan_tags, horizon)
+        logging.info(f"Prefetch round ({cwl_phase()}): refreshed {refreshed} entries, {len(clan_tags)} clans tracked")
+
+    async def _refresh_due(self, kind, tags, horizon):
+        due = [tag for tag in tags if self.player_cache.expires_within(kind, tag, horizon)]
+        refreshed = 0
+        for start in range(0, len(due), self.batch_size):
+            results = await asyncio.gather(*(self._refresh(kind, tag) for tag in due[start:start + self.batch_size]))
+            refreshed += sum(result is not None for result in results)
+        return refreshed
+
+    async def _refresh(self, kind, tag):
+        await self.budget.acquire()
+        try:
+            return await self.player_cache.refresh(kind, tag)
+        except coc.errors.ClashOfClansException as e:
+            logging.warning(f"Prefetch {kind} {tag} failed: {e}")
+            return None
@@ -0,0 +1,220 @@
+import bisect
+import math
+from collections import OrderedDict
+
+import discord
+
+from scoring import MAX_TOWN_HALL, score_roster
+
+# Discord embed limits
+FIELD_VALUE_LIMIT = 1024
+FIELD_NAME_LIMIT = 256
+MAX_FIELDS = 25
+# Embeds may hold 6000 characters in total; leave room for the title and footer
+EMBED_BUDGET = 5800
+FOOTER = "CWL Balance Boss"
+
+# Emoji mappings
+HERO_EMOJIS = {
+    'Barbarian King': '<:BarbarianKing:1371194900636500089>',
+    'Archer Queen': '<:ArcherQueen:1371194890091892796>',
+    'Minion Prince': '<:MinionPrince:1371194909213855805>',
+    'Grand Warden': '<:GrandWarden:1371194905011163149>',
+    'Royal Champion': '<:RoyalChampion:1371194913177342175>'
+}
+
+TOWN_HALL_EMOJIS = {
+    0: '<:TownHall1:1371194916604084394>',
+    1: '<:TownHall1:1371194916604084394>',
+    2: '<:TownHall2:1371194919837765822>',
+    3: '<:TownHall3:1371194924237721681>',
+    4: '<:TownHall4:1371194928486551562>',
+    5: '<:TownHall5:1371194932823330947>',
+    6: '<:TownHall6:1371194936896262245>',
+    7: '<:TownHall7:1371194941404872734>',
+    8: '<:TownHall8:1371194945679134811>',
+    9: '<:TownHall9:1371194950171099229>',
+    10: '<:TownHall10:1371194955179102308>',
+    11: '<:TownHall11:1371194959281000528>',
+    12: '<:TownHall12:1371194962426986696>',
+    13: '<:TownHall13:1371194967044915210>',
+    14: '<:TownHall14:1371194970165477437>',
+    15: '<:TownHall15:1371194974435016926>',
+    16: '<:TownHall16:1371194979166195723>',
+    17: '<:TownHall17:1371194983423414322>'
+}
+
+TROPHY_LEAGUE_EMOJIS = {
+    (0, 799): '<:Icon_Bronze:1371820654831341578>',
+    (800, 1399): '<:Icon_Silver:1371820651677220925>',
+    (1400, 1999): '<:Icon_Gold:1371820648220983337>',
+    (2000, 2599): '<:Icon_Crystal:1371820644785983689>',
+    (2600, 3199): '<:Icon_Master:1371820640545275975>',
+    (3200, 4099): '<:Icon_Champion:1371820636695040091>',
+    (4100, 4999): '<:Icon_Titan:1371820631892426794>',
+    (5000, float('inf')): '<:Icon_Legend:1371820627350130718>'
+}
+
+# Lookup tables derived once at import: league floors for bisect, TH emoji by index, heroes in display order
+_LEAGUES = sorted(TROPHY_LEAGUE_EMOJIS.items())
+TROPHY_FLOORS = [low for (low, _), _ in _LEAGUES]
+TROPHY_EMOJIS = [emoji for _, emoji in _LEAGUES]
+TOWN_HALL_TABLE = tuple(TOWN_HALL_EMOJIS.get(th, '') for th in range(MAX_TOWN_HALL + 1))
+HERO_ORDER = tuple(HERO_EMOJIS.items())
+
+
+def league_emoji(trophies):
+    return TROPHY_EMOJIS[max(0, bisect.bisect_right(TROPHY_FLOORS, trophies) - 1)]
+
+
+def town_hall_emoji(town_hall):
+    return TOWN_HALL_TABLE[town_hall] if 0 <= town_hall <= MAX_TOWN_HALL else ''
+
+
+def _hero_levels(player):
+    levels = {hero.name: hero.level for hero in player.heroes}
+    return "  ".join(f"{emoji} {levels[name]}" for name, emoji in HERO_ORDER if name in levels) or "None"
+
+
+def _clan_link(player):
+    if not player.clan:
+        return "Clan: No Clan"
+    return f"[Clan: {player.clan.name}](https://link.clashofclans.com/en?action=OpenClanProfile&tag={player.clan.tag.lstrip('#')})"
+
+
+def _member_info(player):
+    return (
+        f"{town_hall_emoji(player.town_hall)} Town Hall: {player.town_hall}\n"
+        f"<:Icon_Clan:1371824433492135966> {_clan_link(player)}\n"
+        f"{league_emoji(player.trophies)} Trophies: {player.trophies}"
+    )
+
+
+def _rush_summary(player):
+    scores = score_roster([player])
+    lines = [f"Rushed: {scores.hero_rush[0]:.2f}%"]
+    if not math.isnan(scores.pet_rush[0]):
+        lines.append(f"Pets: {scores.pet_rush[0]:.2f}%")
+    if not math.isnan(scores.equipment_rush[0]):
+        lines.append(f"Equipment: {scores.equipment_rush[0]:.2f}%")
+    return "\n".join(lines)
+
+
+def _account_line(player):
+    return f"{town_hall_emoji(player.town_hall)} {player.name} - ({player.tag})"
+
+
+class FragmentCache:
+    """Rendered strings per (fragment, tag), valid for as long as the same player object is cached.
+
+    PlayerCache stores a new object on every fetch, so object identity is the
+    data version; keeping a reference to it here means the identity cannot be
+    reused by another object while the entry exists.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, kind, obj, render):
+        key = (kind, obj.tag)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is obj:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = render(obj)
+        self._entries[key] = (obj, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+fragments = FragmentCache()
+
+
+def member_info(player):
+    return fragments.get('member_info', player, _member_info)
+
+
+def hero_line(player):
+    return fragments.get('heroes', player, _hero_levels)
+
+
+def rush_summary(player):
+    return fragments.get('rush', player, _rush_summary)
+
+
+def account_line(player):
+    return fragments.get('account', player, _account_line)
+
+
+def join_lines(lines, limit=FIELD_VALUE_LIMIT):
+    """Join lines for an embed field, cutting off with a count of the lines that did not fit."""
+    value = "\n".join(lines)
+    if len(value) <= limit:
+        return value or "None"
+    kept = []
+    used = 0
+    for index, line in enumerate(lines):
+        more = f"+{len(lines) - index} more"
+        if used + len(line) + 1 + len(more) > limit:
+            return "\n".join(kept + [more])
+        kept.append(line)
+        used += len(line) + 1
+    return "\n".join(kept)
+
+
+def split_lines(lines, limit=FIELD_VALUE_LIMIT):
+    """Pack lines into as few field values of at most `limit` characters as possible."""
+    chunks, current, used = [], [], 0
+    for line in lines:
+        line = line[:limit]
+        if current and used + 1 + len(line) > limit:
+            chunks.append("\n".join(current))
+            current, used = [], 0
+        used += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks or ["None"]
+
+
+def add_line_fields(embed, name, lines):
+    """Add `lines` as one field, or as continued fields when they pass the field limit.
+
+    Whatever would push the embed past 25 fields or its size budget is cut off
+    with a count of the lines left out, so the embed is always sendable.
+    """
+    chunks = split_lines(lines)
+    for index, chunk in enumerate(chunks):
+        field_name = name if index == 0 else f"{name} (cont.)"
+        room = EMBED_BUDGET - len(embed) - len(field_name)
+        last = len(embed.fields) == MAX_FIELDS - 1 or room < FIELD_VALUE_LIMIT
+        if last and (index < len(chunks) - 1 or len(chunk) > room):
+            rest = [line for later in chunks[index:] for line in later.split("\n")]
+            embed.add_field(name=field_name, value=join_lines(rest, min(FIELD_VALUE_LIMIT, max(room, 32))), inline=False)
+            return
+        embed.add_field(name=field_name, value=chunk, inline=False)
+
+
+def build_pages(title, color, description, fields):
+    """Spread (name, value) fields over as many embeds as Discord's size limits require."""
+    pages = [discord.Embed(title=title, description=description, color=color)]
+    for name, value in fields:
+        name, value = name[:FIELD_NAME_LIMIT], value[:FIELD_VALUE_LIMIT]
+        page = pages[-1]
+        if len(page.fields) == MAX_FIELDS or len(page) + len(name) + len(value) > EMBED_BUDGET:
+            page = discord.Embed(title=f"{title} (cont.)", color=color)
+            pages.append(page)
+        page.add_field(name=name, value=value, inline=False)
+    for page in pages:
+        page.set_footer(text=FOOTER)
+    return pages
@@ -0,0 +1,127 @@
+import csv
+import io
+import math
+from collections import Counter
+
+from scoring import HEROES, score_roster
+
+
+class ReportRow:
+    """One clan member (or sheet account) in a clan report."""
+
+    __slots__ = ('tag', 'name', 'town_hall', 'heroes', 'hero_rush', 'rush', 'owner', 'sheet_clan', 'in_clan')
+
+    def __init__(self, tag, name, town_hall, heroes, hero_rush, rush, owner, sheet_clan, in_clan):
+        self.tag = tag
+        self.name = name
+        self.town_hall = town_hall
+        # {hero name: level}; empty when the player could not be fetched
+        self.heroes = heroes
+        self.hero_rush = hero_rush
+        self.rush = rush
+        self.owner = owner
+        self.sheet_clan = sheet_clan
+        self.in_clan = in_clan
+
+
+class ClanRef:
+    """Just the tag and name of a clan, all a report needs once it leaves the process that built it."""
+
+    __slots__ = ('tag', 'name')
+
+    def __init__(self, tag, name):
+        self.tag = tag
+        self.name = name
+
+
+class ClanReport:
+    """CWL readiness of one clan, cross-referenced against the roster sheet."""
+
+    __slots__ = ('clan', 'rows', 'failed')
+
+    def __init__(self, clan, rows, failed):
+        self.clan = clan
+        self.rows = rows
+        # Tags of clan members whose player data could not be fetched
+        self.failed = failed
+
+    def detached(self):
+        """A copy holding a ClanRef instead of the API clan object, so it can be pickled."""
+        return ClanReport(ClanRef(self.clan.tag, self.clan.name), self.rows, self.failed)
+
+    @property
+    def members(self):
+        return [row for row in self.rows if row.in_clan]
+
+    @property
+    def in_sheet_not_clan(self):
+        """Accounts the sheet puts in this clan that are not in it."""
+        return [row for row in self.rows if not row.in_clan]
+
+    @property
+    def in_clan_not_sheet(self):
+        """Clan members the sheet does not list under this clan; `sheet_clan` says where it has them, if anywhere."""
+        return [row for row in self.rows if row.in_clan and not self._listed(row)]
+
+    def _listed(self, row):
+        return row.sheet_clan is not None and row.sheet_clan.upper() in (self.clan.name.upper(), self.clan.tag.upper())
+
+    @property
+    def town_halls(self):
+        """`{town hall: member count}`, highest first."""
+        return dict(sorted(Counter(row.town_hall for row in self.members).items(), reverse=True))
+
+    @property
+    def hero_totals(self):
+        """`{hero: (total levels, members with the hero)}` in scoring.HEROES order."""
+        totals = {}
+        for hero in HEROES:
+            levels = [row.heroes[hero] for row in self.members if hero in row.heroes]
+            if levels:
+                totals[hero] = (sum(levels), len(levels))
+        return totals
+
+    @property
+    def average_rush(self):
+        scored = [row.rush for row in self.members if not math.isnan(row.rush)]
+        return sum(scored) / len(scored) if scored else 0.0
+
+    def to_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['TAG', 'NAME', 'Town-Hall', *HEROES, 'Hero Rush %', 'Rush %', 'ID', 'Sheet CLAN', 'In Clan'])
+        for row in self.rows:
+            writer.writerow([
+                row.tag, row.name, row.town_hall, *(row.heroes.get(hero, '') for hero in HEROES),
+                '' if math.isnan(row.hero_rush) else f"{row.hero_rush:.2f}",
+                '' if math.isnan(row.rush) else f"{row.rush:.2f}",
+                row.owner or '', row.sheet_clan or '', 'yes' if row.in_clan else 'no',
+            ])
+        return out.getvalue()
+
+
+def clan_report(clan, roster, players):
+    """Build a ClanReport from a clan, the guild's Roster and `{tag: player}` for the members that were fetched.
+
+    The sheet's CLAN column may hold either the clan's name or its tag.
+    """
+    scores = score_roster(list(players.values()))
+    member_tags = set()
+    rows = []
+    for member in clan.members:
+        member_tags.add(member.tag)
+        account = roster.get(member.tag)
+        owner, sheet_clan = (account.discord_id, account.clan) if account else (None, None)
+        player = players.get(member.tag)
+        if player is None:
+            rows.append(ReportRow(member.tag, member.name, member.town_hall, {}, math.nan, math.nan, owner, sheet_clan, True))
+            continue
+        index = scores.index(member.tag)
+        heroes = {hero.name: hero.level for hero in player.heroes}
+        rows.append(ReportRow(member.tag, player.name, player.town_hall, heroes, float(scores.hero_rush[index]), float(scores.rush[index]), owner, sheet_clan, True))
+    listed = {account.tag: account for key in (clan.name, clan.tag) for account in roster.clan_members(key)}
+    for tag, account in listed.items():
+        if tag not in member_tags:
+            rows.append(ReportRow(tag, account.name, account.town_hall, {}, math.nan, math.nan, account.discord_id, account.clan, False))
+    failed = [row.tag for row in rows if row.in_clan and row.tag not in players]
+    return ClanReport(clan, rows, failed)
@@ -0,0 +1,169 @@
+# Sheet columns the roster is built from
+COLUMNS = ('ID', 'TAG', 'NAME', 'CLAN', 'Town-Hall')
+
+
+class Account:
+    """One roster row from the sheet."""
+
+    __slots__ = ('discord_id', 'tag', 'name', 'clan', 'town_hall')
+
+    def __init__(self, discord_id, tag, name, clan, town_hall):
+        self.discord_id = discord_id
+        self.tag = tag
+        self.name = name
+        self.clan = clan
+        self.town_hall = town_hall
+
+    def __repr__(self):
+        return f"<Account {self.tag} {self.name!r} TH{self.town_hall} clan={self.clan!r} owner={self.discord_id}>"
+
+    @property
+    def fields(self):
+        return self.discord_id, self.tag, self.name, self.clan, self.town_hall
+
+
+def parse_town_hall(value):
+    value = str(value).strip()
+    return int(value) if value.isdigit() else 0
+
+
+def parse_rows(records):
+    """Normalise sheet records into `{tag: fields}`, skipping rows without an ID or a valid tag."""
+    rows = {}
+    for row in records:
+        discord_id = str(row['ID']).strip()
+        tag = str(row['TAG']).strip().upper()
+        if not discord_id or not tag.startswith('#'):
+            continue
+        rows[tag] = (discord_id, tag, str(row['NAME']).strip(), str(row['CLAN']).strip(), parse_town_hall(row['Town-Hall']))
+    return rows
+
+
+class RosterDiff:
+    """Accounts added, removed and changed between two loads of the same sheet."""
+
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self, added=(), removed=(), changed=()):
+        self.added = tuple(added)
+        self.removed = tuple(removed)
+        # (old, new) Account pairs
+        self.changed = tuple(changed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return f"<RosterDiff +{len(self.added)} -{len(self.removed)} ~{len(self.changed)}>"
+
+    @property
+    def tags(self):
+        """Every tag the diff touches."""
+        return {account.tag for account in self.added + self.removed} | {new.tag for _, new in self.changed}
+
+
+def diff_rows(roster, rows):
+    """Compare parsed rows against a previous Roster (or None)."""
+    if roster is None:
+        return RosterDiff(added=[Account(*fields) for fields in rows.values()])
+    added, changed = [], []
+    for tag, fields in rows.items():
+        account = roster.get(tag)
+        if account is None:
+            added.append(Account(*fields))
+        elif account.fields != fields:
+            changed.append((account, Account(*fields)))
+    removed = [account for account in roster if account.tag not in rows]
+    return RosterDiff(added, removed, changed)
+
+
+def _group(accounts, key, only=None):
+    groups = {}
+    for account in accounts:
+        value = key(account)
+        if only is None or value in only:
+            groups.setdefault(value, []).append(account)
+    return {value: tuple(members) for value, members in groups.items()}
+
+
+def _owner_key(account):
+    return account.discord_id
+
+
+def _clan_key(account):
+    return account.clan.upper()
+
+
+def _town_hall_key(account):
+    return account.town_hall
+
+
+class Roster:
+    """Roster accounts with hash indexes built once per load.
+
+    Lookups by Discord ID, tag, clan and town hall are dict hits; each index
+    maps to tuples of the same Account objects, so no rows are copied.
+    """
+
+    __slots__ = ('accounts', '_by_tag', '_by_owner', '_by_clan', '_by_town_hall')
+
+    def __init__(self, accounts):
+        self.accounts = tuple(accounts)
+        self._by_tag = {account.tag: account for account in self.accounts}
+        self._by_owner = _group(self.accounts, _owner_key)
+        self._by_clan = _group(self.accounts, _clan_key)
+        self._by_town_hall = _group(self.accounts, _town_hall_key)
+
+    def patched(self, diff):
+        """A new Roster with `diff` applied, reusing unchanged Accounts and re-grouping only affected index keys."""
+        by_tag = dict(self._by_tag)
+        for account in diff.removed:
+            del by_tag[account.tag]
+        for _, account in diff.changed:
+            by_tag[account.tag] = account
+        for account in diff.added:
+            by_tag[account.tag] = account
+        touched = diff.added + diff.removed + tuple(account for pair in diff.changed for account in pair)
+
+        roster = Roster.__new__(Roster)
+        roster.accounts = tuple(by_tag.values())
+        roster._by_tag = by_tag
+        for attr, key in (('_by_owner', _owner_key), ('_by_clan', _clan_key), ('_by_town_hall', _town_hall_key)):
+            affected = {key(account) for account in touched}
+            index = {value: members for value, members in getattr(self, attr).items() if value not in affected}
+            index.update(_group(roster.accounts, key, affected))
+            setattr(roster, attr, index)
+        return roster
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __iter__(self):
+        return iter(self.accounts)
+
+    def __contains__(self, tag):
+        return tag in self._by_tag
+
+    def get(self, tag):
+        return self._by_tag.get(tag)
+
+    def accounts_for(self, discord_id):
+        return self._by_owner.get(str(discord_id), ())
+
+    def clan_members(self, clan):
+        return self._by_clan.get(clan.strip().upper(), ())
+
+    def town_hall_members(self, town_hall):
+        return self._by_town_hall.get(town_hall, ())
+
+    @property
+    def tags(self):
+        return self._by_tag.keys()
+
+    @property
+    def owners(self):
+        return self._by_owner.keys()
+
+    @property
+    def clans(self):
+        return self._by_clan.keys()
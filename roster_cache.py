@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+from roster import Account, Roster, diff_rows
+
+
+class RosterSnapshot:
+    """A parsed Roster plus the sheet revision it was read at."""
+
+    __slots__ = ('sheet_id', 'roster', 'version', 'fetched_at', 'checked_at')
+
+    def __init__(self, sheet_id, roster, version):
+        self.sheet_id = sheet_id
+        self.roster = roster
+        self.version = version
+        self.fetched_at = self.checked_at = time.monotonic()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.checked_at
+
+
+class RosterCache:
+    """Roster snapshots keyed by sheet ID with TTL and stale-while-revalidate.
+
+    Fresh snapshots are returned as-is. Once a snapshot is older than `ttl` it is
+    still served, while a background task compares the sheet's last update time
+    and only re-downloads the roster when the sheet actually changed. Snapshots
+    older than `max_stale` are revalidated before being returned.
+
+    `loader(sheet_id)` returns parsed rows (see roster.parse_rows). Reloads are
+    diffed against the previous snapshot: unchanged Account objects are kept,
+    only affected index keys are rebuilt, and each listener is called with
+    `(sheet_id, diff)` so downstream caches can update just those accounts.
+
+    Fields the API reports more recently than the sheet (a renamed account, a
+    new town hall) are kept in a separate `live` overlay, so snapshots always
+    match the sheet and reloads only ever diff real sheet edits.
+
+    With a `store` (cache.SqliteTier) every load is saved, and the first miss
+    for a sheet after a restart is answered from the saved copy, which is then
+    revalidated in the background like any stale snapshot.
+    """
+
+    def __init__(self, sheets_io, loader, ttl=300.0, max_stale=3600.0, store=None):
+        self.sheets_io = sheets_io
+        self.loader = loader
+        self.store = store
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.listeners = []
+        # tag -> fields last reported by the API, laid over the sheet's values by `live_view`
+        self.live = {}
+        # Called with the tag whenever its live fields change
+        self.live_listeners = []
+        self._snapshots = {}
+        self._inflight = {}
+
+    def peek(self, sheet_id):
+        return self._snapshots.get(sheet_id)
+
+    async def get(self, sheet_id, force=False):
+        snapshot = self._snapshots.get(sheet_id)
+        if force:
+            metrics.incr('roster_cache', result='forced')
+            return await asyncio.shield(self._start(sheet_id, self._load(sheet_id)))
+        if snapshot is None:
+            metrics.incr('roster_cache', result='miss')
+            snapshot = await self._shared(sheet_id, lambda: self._restore_or_load(sheet_id))
+            if snapshot.age < self.ttl:
+                return snapshot
+        elif snapshot.age < self.ttl:
+            metrics.incr('roster_cache', result='hit')
+            return snapshot
+        else:
+            metrics.incr('roster_cache', result='stale')
+        if self.max_stale is not None and snapshot.age >= self.max_stale:
+            return await self._shared(sheet_id, lambda: self._revalidate(snapshot))
+        if sheet_id not in self._inflight:
+            task = self._start(sheet_id, self._revalidate(snapshot))
+            task.add_done_callback(self._log_failure)
+        return snapshot
+
+    def apply(self, tag, **fields):
+        """Record live fields of an account (e.g. name or town_hall from the API).
+
+        Returns whether any snapshot holds the tag; fields of other tags are
+        not kept. The snapshots themselves are left as the sheet has them.
+        """
+        if not any(tag in snapshot.roster for snapshot in self._snapshots.values()):
+            return False
+        if self.live.get(tag) != fields:
+            self.live[tag] = fields
+            for listener in self.live_listeners:
+                try:
+                    listener(tag)
+                except Exception:
+                    logging.exception(f"Live listener failed for {tag}")
+        return True
+
+    def live_view(self, account):
+        """The account with its live fields, if any, in place of the sheet's."""
+        fields = self.live.get(account.tag)
+        if not fields:
+            return account
+        return Account(*(fields.get(name, value) for name, value in zip(Account.__slots__, account.fields)))
+
+    def _start(self, sheet_id, coro):
+        task = asyncio.ensure_future(coro)
+        self._inflight[sheet_id] = task
+        task.add_done_callback(lambda t: self._inflight.pop(sheet_id) if self._inflight.get(sheet_id) is t else None)
+        return task
+
+    async def _shared(self, sheet_id, make_coro):
+        # Concurrent callers for the same sheet wait on a single download
+        task = self._inflight.get(sheet_id) or self._start(sheet_id, make_coro())
+        return await asyncio.shield(task)
+
+    async def _restore_or_load(self, sheet_id):
+        saved = await self.store.get_roster(sheet_id) if self.store else None
+        if saved is None:
+            return await self._load(sheet_id)
+        rows, version, saved_at = saved
+        snapshot = RosterSnapshot(sheet_id, Roster(diff_rows(None, rows).added), version)
+        # Treat the saved copy as just past its TTL so it is served and revalidated in the background
+        snapshot.fetched_at = snapshot.checked_at = time.monotonic() - self.ttl
+        self._snapshots[sheet_id] = snapshot
+        logging.info(f"Roster {sheet_id} restored: {len(snapshot.roster)} accounts saved {time.time() - saved_at:.0f}s ago")
+        return snapshot
+
+    async def _load(self, sheet_id, version=None):
+        if version is None:
+            version = await self.sheets_io.last_update_time(sheet_id)
+        rows = await self.loader(sheet_id)
+        previous = self._snapshots.get(sheet_id)
+        diff = diff_rows(previous.roster if previous else None, rows)
+        if previous is None:
+            roster = Roster(diff.added)
+        elif diff:
+            roster = previous.roster.patched(diff)
+        else:
+            roster = previous.roster
+        snapshot = RosterSnapshot(sheet_id, roster, version)
+        self._snapshots[sheet_id] = snapshot
+        if self.store and (previous is None or diff or version != previous.version):
+            task = asyncio.ensure_future(self.store.put_roster(sheet_id, rows, version))
+            task.add_done_callback(self._log_failure)
+        logging.info(f"Roster {sheet_id} loaded: {len(roster)} accounts at revision {version} {diff!r}")
+        if previous is not None and diff:
+            for account in diff.removed:
+                if not any(account.tag in other.roster for other in self._snapshots.values()):
+                    self.live.pop(account.tag, None)
+            self._notify(sheet_id, diff)
+        return snapshot
+
+    def _notify(self, sheet_id, diff):
+        for listener in self.listeners:
+            try:
+                listener(sheet_id, diff)
+            except Exception:
+                logging.exception(f"Roster listener failed for {sheet_id}")
+
+    async def _revalidate(self, snapshot):
+        version = await self.sheets_io.last_update_time(snapshot.sheet_id)
+        if version and version == snapshot.version:
+            snapshot.checked_at = time.monotonic()
+            return snapshot
+        return await self._load(snapshot.sheet_id, version)
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"Roster background task failed: {task.exception()}")
@@ -0,0 +1,128 @@
+import numpy as np
+
+# Minimum hero levels expected once a town hall reaches each threshold
+EXPECTED_HERO_LEVELS = {
+    7: {'Barbarian King': 5},
+    9: {'Barbarian King': 30, 'Archer Queen': 30},
+    11: {'Barbarian King': 50, 'Archer Queen': 50, 'Grand Warden': 20},
+    13: {'Barbarian King': 75, 'Archer Queen': 75, 'Grand Warden': 50, 'Royal Champion': 25},
+    15: {'Barbarian King': 85, 'Archer Queen': 85, 'Grand Warden': 60, 'Royal Champion': 35},
+    17: {'Barbarian King': 95, 'Archer Queen': 95, 'Grand Warden': 70, 'Royal Champion': 45, 'Minion Prince': 20}
+}
+
+# Minimum pet levels expected once a town hall reaches each threshold
+EXPECTED_PET_LEVELS = {
+    14: {'L.A.S.S.I': 10, 'Electro Owl': 5, 'Mighty Yak': 10, 'Unicorn': 5},
+    15: {'L.A.S.S.I': 10, 'Electro Owl': 10, 'Mighty Yak': 10, 'Unicorn': 10, 'Frosty': 5, 'Diggy': 5, 'Poison Lizard': 5, 'Phoenix': 5},
+    16: {'L.A.S.S.I': 15, 'Electro Owl': 10, 'Mighty Yak': 15, 'Unicorn': 10, 'Frosty': 10, 'Diggy': 10, 'Poison Lizard': 10, 'Phoenix': 10, 'Spirit Fox': 5, 'Angry Jelly': 5}
+}
+
+# Fraction of an equipment piece's max level expected at each town hall threshold
+EXPECTED_EQUIPMENT_RATIO = {8: 0.2, 10: 0.35, 12: 0.5, 13: 0.6, 14: 0.66, 15: 0.75, 16: 0.85, 17: 0.9}
+
+MAX_TOWN_HALL = 17
+
+# Component weights for the combined rush score; components a player has no data for are skipped
+RUSH_WEIGHTS = {'heroes': 1.0, 'pets': 0.5, 'equipment': 0.5}
+# Rush assumed for an account that could not be scored when there is nothing to compare it with
+UNKNOWN_RUSH = 50.0
+
+
+def _threshold_table(thresholds, columns):
+    # Row per TH: the expectations of the highest threshold reached (0 = not expected)
+    table = np.zeros((MAX_TOWN_HALL + 1, len(columns)))
+    for th, levels in sorted(thresholds.items()):
+        table[th:] = 0
+        for name, level in levels.items():
+            table[th:, columns[name]] = level
+    return table
+
+
+def _ratio_table(thresholds):
+    table = np.zeros(MAX_TOWN_HALL + 1)
+    for th, ratio in sorted(thresholds.items()):
+        table[th:] = ratio
+    return table
+
+
+HEROES = tuple(sorted({hero for levels in EXPECTED_HERO_LEVELS.values() for hero in levels}))
+HERO_INDEX = {hero: index for index, hero in enumerate(HEROES)}
+HERO_TABLE = _threshold_table(EXPECTED_HERO_LEVELS, HERO_INDEX)
+PETS = tuple(sorted({pet for levels in EXPECTED_PET_LEVELS.values() for pet in levels}))
+PET_INDEX = {pet: index for index, pet in enumerate(PETS)}
+PET_TABLE = _threshold_table(EXPECTED_PET_LEVELS, PET_INDEX)
+EQUIPMENT_RATIO = _ratio_table(EXPECTED_EQUIPMENT_RATIO)
+
+
+def _shortfall(levels, expected):
+    # Mean of max(0, (expected - level) / expected) over cells that have both a level and an expectation;
+    # rows with no such cells are NaN
+    valid = ~np.isnan(levels) & (expected > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        short = np.where(valid, np.clip((expected - levels) / expected, 0, None), 0.0)
+        counts = valid.sum(axis=1)
+        return np.where(counts > 0, short.sum(axis=1) / counts, np.nan)
+
+
+class RosterScores:
+    """Per-account rush components for a batch of players, as parallel arrays (percentages, NaN = no data)."""
+
+    __slots__ = ('tags', 'town_hall', 'hero_rush', 'pet_rush', 'equipment_rush', 'rush', 'strength', '_index')
+
+    def __init__(self, tags, town_hall, hero_rush, pet_rush, equipment_rush):
+        self.tags = tags
+        self.town_hall = town_hall
+        self.hero_rush = hero_rush
+        self.pet_rush = pet_rush
+        self.equipment_rush = equipment_rush
+        components = np.stack([hero_rush, pet_rush, equipment_rush])
+        weights = np.array([RUSH_WEIGHTS['heroes'], RUSH_WEIGHTS['pets'], RUSH_WEIGHTS['equipment']])[:, None]
+        present = ~np.isnan(components)
+        total_weight = (weights * present).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            self.rush = np.where(total_weight > 0, (np.nan_to_num(components) * weights).sum(axis=0) / total_weight, 0.0)
+        self.strength = town_hall + 1 - self.rush / 100
+        self._index = {tag: index for index, tag in enumerate(tags)}
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag):
+        return tag in self._index
+
+    def index(self, tag):
+        return self._index[tag]
+
+
+def score_roster(players):
+    """Score every player in one vectorised pass over preallocated level matrices."""
+    n = len(players)
+    town_hall = np.zeros(n, dtype=int)
+    heroes = np.full((n, len(HEROES)), np.nan)
+    pets = np.full((n, len(PETS)), np.nan)
+    width = max((len(getattr(player, 'equipment', ()) or ()) for player in players), default=0)
+    equipment = np.full((n, width), np.nan)
+    equipment_max = np.zeros((n, width))
+    for row, player in enumerate(players):
+        town_hall[row] = player.town_hall
+        for hero in player.heroes:
+            column = HERO_INDEX.get(hero.name)
+            if column is not None:
+                heroes[row, column] = hero.level
+        for pet in getattr(player, 'pets', None) or ():
+            column = PET_INDEX.get(pet.name)
+            if column is not None:
+                pets[row, column] = pet.level
+        for column, item in enumerate(getattr(player, 'equipment', None) or ()):
+            equipment[row, column] = item.level
+            equipment_max[row, column] = item.max_level
+    th = np.clip(town_hall, 0, MAX_TOWN_HALL)
+    hero_rush = np.nan_to_num(_shortfall(heroes, HERO_TABLE[th])) * 100
+    pet_rush = _shortfall(pets, PET_TABLE[th]) * 100
+    equipment_rush = _shortfall(equipment, EQUIPMENT_RATIO[th][:, None] * equipment_max) * 100
+    return RosterScores([player.tag for player in players], town_hall.astype(float), hero_rush, pet_rush, equipment_rush)
+
+
+def strength(town_hall, rushed_percentage):
+    """Town hall level adjusted by development: a fully developed TH16 scores 17, a fully rushed one 16."""
+    return town_hall + 1 - rushed_percentage / 100
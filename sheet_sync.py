@@ -0,0 +1,73 @@
+from scoring import HEROES, score_roster
+
+# Columns /sync_sheet keeps in line with the API; the optional ones are only written where the sheet has them
+SYNCED_COLUMNS = ('NAME', 'Town-Hall')
+# Hero rush, the same figure /player shows as "Rushed"
+RUSH_COLUMN = 'Rush %'
+OPTIONAL_COLUMNS = HEROES + (RUSH_COLUMN,)
+
+
+class SyncResult:
+    __slots__ = ('cells', 'calls', 'fetched', 'tags', 'columns')
+
+    def __init__(self, cells, calls, fetched, tags, columns):
+        # (row, header, value) cells that differed from the live data
+        self.cells = cells
+        self.calls = calls
+        self.fetched = fetched
+        self.tags = tags
+        self.columns = columns
+
+    @property
+    def rows(self):
+        return len({row for row, _, _ in self.cells})
+
+
+def _same(current, value):
+    current = str(current).strip()
+    if current == str(value):
+        return True
+    # Numbers come back formatted by the sheet, e.g. '12.30' or '12.3%'
+    try:
+        return abs(float(current.rstrip('%')) - float(value)) < 0.05
+    except ValueError:
+        return False
+
+
+def sheet_changes(records, players, columns):
+    """Cells where `players` ({tag: player}) differ from sheet `records`, which start at row 2.
+
+    Only headers in `columns` are compared, and a player without a hero
+    leaves that hero's cell alone.
+    """
+    scores = score_roster(list(players.values()))
+    cells = []
+    for offset, record in enumerate(records):
+        tag = str(record['TAG']).strip().upper()
+        player = players.get(tag)
+        if player is None:
+            continue
+        values = {hero.name: hero.level for hero in player.heroes}
+        values.update({'NAME': player.name, 'Town-Hall': player.town_hall, RUSH_COLUMN: round(float(scores.hero_rush[scores.index(tag)]), 1)})
+        for header in columns:
+            if header in values and not _same(record.get(header, ''), values[header]):
+                cells.append((offset + 2, header, values[header]))
+    return cells
+
+
+async def sync_roster(sheets_io, player_cache, sheet_id, budget=None, heroes=True, dry_run=False):
+    """Bring the roster sheet's name, town hall and (optionally) hero/rush columns in line with the API.
+
+    Reads the sheet fresh, fetches every tag through the player cache and
+    writes only the cells that differ, batched into as few calls as possible.
+    Running it again straight away finds nothing to change and makes no
+    write call at all.
+    """
+    positions = await sheets_io.header_positions(sheet_id)
+    columns = [header for header in SYNCED_COLUMNS + (OPTIONAL_COLUMNS if heroes else ()) if header in positions]
+    records = await sheets_io.read_columns(sheet_id, ('TAG',) + tuple(columns))
+    tags = list(dict.fromkeys(tag for tag in (str(record['TAG']).strip().upper() for record in records) if tag.startswith('#')))
+    players = {tag: player async for tag, player, error in player_cache.stream(tags, budget) if player}
+    cells = sheet_changes(records, players, columns)
+    calls = 0 if dry_run else await sheets_io.write_cells(sheet_id, cells)
+    return SyncResult(cells, calls, len(players), len(tags), columns)
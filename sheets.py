@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+
+from metrics import metrics
+
+SHEET_URL_PATTERN = re.compile(r'https://docs\.google\.com/spreadsheets/d/([a-zA-Z0-9-_]+)/')
+
+
+def parse_sheet_id(url):
+    """Extract the spreadsheet key from a Google Sheet URL."""
+    match = SHEET_URL_PATTERN.match(url or '')
+    return match.group(1) if match else None
+
+
+class SheetsIO:
+    """Runs blocking gspread calls on a bounded thread pool so the event loop never waits on Google.
+
+    Pass either a ready `gs_client` or an `authorize` callable returning one;
+    the latter is called on a worker thread the first time the API is needed
+    (or by `connect`), so loading credentials never blocks import or the loop.
+    """
+
+    def __init__(self, gs_client=None, max_workers=4, timeout=30.0, authorize=None):
+        self.timeout = timeout
+        self.authorize = authorize
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        self._spreadsheets = {}
+        self._headers = {}
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self.gs_client = None
+        if gs_client is not None:
+            self._attach(gs_client)
+
+    def _attach(self, gs_client):
+        # HTTP-level timeout so a hung request frees its worker thread as well
+        gs_client.set_timeout(self.timeout)
+        self.gs_client = gs_client
+
+    def _client(self):
+        if self.gs_client is None:
+            with self._auth_lock:
+                if self.gs_client is None:
+                    if self.authorize is None:
+                        raise RuntimeError("Google Sheets client is not configured")
+                    self._attach(self.authorize())
+        return self.gs_client
+
+    async def connect(self, timeout=None):
+        """Authorize now rather than on the first sheet read."""
+        await self.run(self._client, timeout=timeout)
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Run a blocking callable in the pool, cancelling the wait after `timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        with metrics.span('sheets_call_seconds'):
+            return await asyncio.wait_for(future, timeout or self.timeout)
+
+    def _spreadsheet(self, sheet_id):
+        # Reuse the opened spreadsheet so repeat reads skip the metadata round-trip
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(sheet_id)
+        if spreadsheet is None:
+            spreadsheet = self._client().open_by_key(sheet_id)
+            with self._lock:
+                self._spreadsheets[sheet_id] = spreadsheet
+        return spreadsheet
+
+    def _worksheet(self, sheet_id):
+        return self._spreadsheet(sheet_id).sheet1
+
+    def _column_positions(self, sheet_id, worksheet, headers):
+        positions = self._headers.get(sheet_id)
+        if positions is None or any(header not in positions for header in headers):
+            positions = {name.strip(): index + 1 for index, name in enumerate(worksheet.row_values(1)) if name.strip()}
+            missing = [header for header in headers if header not in positions]
+            if missing:
+                raise ValueError(f"Sheet is missing columns: {', '.join(missing)}")
+            self._headers[sheet_id] = positions
+        return positions
+
+    def _read_columns(self, sheet_id, headers, retry=True):
+        worksheet = self._worksheet(sheet_id)
+        positions = self._column_positions(sheet_id, worksheet, headers)
+        letters = [gspread.utils.rowcol_to_a1(1, positions[header]).rstrip('0123456789') for header in headers]
+        ranges = worksheet.batch_get([f"{letter}:{letter}" for letter in letters], major_dimension=gspread.utils.Dimension.cols)
+        columns = [value_range[0] if value_range else [] for value_range in ranges]
+        # Row 1 comes back with each column, so a reordered header is caught without an extra request
+        if any(str(column[0]).strip() != header if column else True for column, header in zip(columns, headers)):
+            self._headers.pop(sheet_id, None)
+            if retry:
+                return self._read_columns(sheet_id, headers, retry=False)
+            raise ValueError("Sheet header changed while reading")
+        height = max(len(column) for column in columns)
+        return [
+            {header: column[row] if row < len(column) else '' for header, column in zip(headers, columns)}
+            for row in range(1, height)
+        ]
+
+    async def read_columns(self, sheet_id, headers, timeout=None):
+        """Read only the named columns of the first worksheet in one batched request, as record dicts."""
+        return await self.run(self._read_columns, sheet_id, tuple(headers), timeout=timeout)
+
+    async def header_positions(self, sheet_id, timeout=None):
+        """`{header: column number}` for the first row of the first worksheet."""
+        return await self.run(lambda: dict(self._column_positions(sheet_id, self._worksheet(sheet_id), ())), timeout=timeout)
+
+    def _write_cells(self, sheet_id, cells, max_ranges):
+        worksheet = self._worksheet(sheet_id)
+        positions = self._column_positions(sheet_id, worksheet, {header for _, header, _ in cells})
+        # Consecutive rows in one column become a single range to keep the request small
+        by_column = {}
+        for row, header, value in sorted(cells, key=lambda cell: (positions[cell[1]], cell[0])):
+            runs = by_column.setdefault(positions[header], [])
+            if runs and runs[-1][0] + len(runs[-1][1]) == row:
+                runs[-1][1].append([value])
+            else:
+                runs.append((row, [[value]]))
+        data = []
+        for column, runs in by_column.items():
+            for start, values in runs:
+                first = gspread.utils.rowcol_to_a1(start, column)
+                last = gspread.utils.rowcol_to_a1(start + len(values) - 1, column)
+                data.append({'range': first if first == last else f"{first}:{last}", 'values': values})
+        for offset in range(0, len(data), max_ranges):
+            worksheet.batch_update(data[offset:offset + max_ranges], value_input_option=gspread.utils.ValueInputOption.raw)
+        return -(-len(data) // max_ranges)
+
+    async def write_cells(self, sheet_id, cells, max_ranges=1000, timeout=None):
+        """Write `(row, header, value)` cells of the first worksheet with as few batch_update calls as possible.
+
+        Returns the number of API calls made.
+        """
+        if not cells:
+            return 0
+        return await self.run(self._write_cells, sheet_id, list(cells), max_ranges, timeout=timeout)
+
+    async def last_update_time(self, sheet_id, timeout=None):
+        """Cheap revision check: the Drive modified time, without downloading any cells."""
+        return await self.run(lambda: self._spreadsheet(sheet_id).get_lastUpdateTime(), timeout=timeout)
+
+    def forget(self, sheet_id):
+        with self._lock:
+            self._spreadsheets.pop(sheet_id, None)
+        self._headers.pop(sheet_id, None)
+
+    def close(self):
+        logging.info("Shutting down Sheets I/O pool")
+        self._executor.shutdown(wait=False, cancel_futures=True)
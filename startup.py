@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import random
+import time
+
+from metrics import metrics
+
+
+class Subsystem:
+    __slots__ = ('name', 'init', 'on_ready', 'ready', 'attempts', 'error', 'task')
+
+    def __init__(self, name, init, on_ready=None):
+        self.name = name
+        self.init = init
+        self.on_ready = on_ready
+        self.ready = False
+        self.attempts = 0
+        self.error = None
+        self.task = None
+
+
+class Startup:
+    """Brings up independent subsystems concurrently and keeps retrying the ones that fail.
+
+    Each subsystem is an async init function. They all start at once, so one
+    slow login never delays another; a failure is logged and retried in the
+    background with jittered exponential backoff while everything that does
+    not depend on it keeps working. `on_ready` callbacks run once, the moment
+    their subsystem first comes up.
+    """
+
+    def __init__(self, base_delay=2.0, max_delay=300.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.subsystems = {}
+        self.started = time.perf_counter()
+
+    def start(self, name, init, on_ready=None):
+        """Start `init` unless the subsystem is already up or still being brought up."""
+        subsystem = self.subsystems.get(name)
+        if subsystem is None:
+            subsystem = self.subsystems[name] = Subsystem(name, init, on_ready)
+        elif subsystem.ready or (subsystem.task and not subsystem.task.done()):
+            return subsystem
+        subsystem.task = asyncio.create_task(self._run(subsystem))
+        return subsystem
+
+    async def _run(self, subsystem):
+        delay = self.base_delay
+        while True:
+            subsystem.attempts += 1
+            started = time.perf_counter()
+            try:
+                await subsystem.init()
+            except Exception as e:
+                subsystem.error = str(e) or type(e).__name__
+                metrics.incr('startup_failures', subsystem=subsystem.name)
+                logging.error(f"Startup of {subsystem.name} failed (attempt {subsystem.attempts}), retrying in {delay:.0f}s: {subsystem.error}")
+                await asyncio.sleep(delay * (1 + random.uniform(0, 0.2)))
+                delay = min(delay * 2, self.max_delay)
+                continue
+            break
+        subsystem.ready = True
+        subsystem.error = None
+        metrics.observe('startup_seconds', time.perf_counter() - started, subsystem=subsystem.name)
+        logging.info(f"{subsystem.name} ready after {time.perf_counter() - self.started:.2f}s ({subsystem.attempts} attempts)")
+        if subsystem.on_ready:
+            try:
+                subsystem.on_ready()
+            except Exception:
+                logging.exception(f"on_ready of {subsystem.name} failed")
+
+    def status(self, name):
+        """'ready', 'starting' or the last error of a subsystem that is being retried."""
+        subsystem = self.subsystems.get(name)
+        if subsystem is None:
+            return 'not started'
+        if subsystem.ready:
+            return 'ready'
+        return f"retrying: {subsystem.error}" if subsystem.error else 'starting'
+
+    @property
+    def stats(self):
+        return {f'{name}_ready': int(subsystem.ready) for name, subsystem in self.subsystems.items()}
+
+    def stop(self):
+        for subsystem in self.subsystems.values():
+            if subsystem.task and not subsystem.task.done():
+                subsystem.task.cancel()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+
+
+def player_changes(old, new):
+    """`(field, before, after)` for the town hall, hero levels and clan of two fetches of a player."""
+    changes = []
+    if old.town_hall != new.town_hall:
+        changes.append(('Town Hall', old.town_hall, new.town_hall))
+    levels = {hero.name: hero.level for hero in old.heroes}
+    for hero in new.heroes:
+        if levels.get(hero.name, 0) != hero.level:
+            changes.append((hero.name, levels.get(hero.name, 0), hero.level))
+    old_clan = old.clan.tag if old.clan else None
+    new_clan = new.clan.tag if new.clan else None
+    if old_clan != new_clan:
+        changes.append(('Clan', old.clan.name if old.clan else "No Clan", new.clan.name if new.clan else "No Clan"))
+    return changes
+
+
+def clan_changes(old, new):
+    """`(tag, name, joined)` for every member that joined or left between two fetches of a clan."""
+    before = {member.tag: member.name for member in old.members}
+    after = {member.tag: member.name for member in new.members}
+    return (
+        [(tag, name, True) for tag, name in after.items() if tag not in before]
+        + [(tag, name, False) for tag, name in before.items() if tag not in after]
+    )
+
+
+class UpdateFeed:
+    """Collects live changes and posts them in debounced batches.
+
+    Changes to the same thing are merged while a batch is open, so a hero
+    going 80 -> 81 -> 82 is posted once as 80 -> 82 and a member who leaves
+    and rejoins is not posted at all. A batch goes out once nothing new
+    arrived for `quiet` seconds, or `max_delay` seconds after it opened.
+    `post(lines)` does the sending.
+    """
+
+    def __init__(self, post, quiet=60.0, max_delay=600.0):
+        self.post = post
+        self.quiet = quiet
+        self.max_delay = max_delay
+        # key -> [before, after, describe(before, after)]
+        self._pending = {}
+        self._opened = self._last = None
+        self._task = None
+
+    @property
+    def stats(self):
+        return {'pending': len(self._pending)}
+
+    def add(self, key, before, after, describe):
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [before, after, describe]
+        else:
+            entry[1], entry[2] = after, describe
+        self._last = time.monotonic()
+        if self._opened is None:
+            self._opened = self._last
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+            self._task.add_done_callback(self._log_failure)
+
+    async def _run(self):
+        while self._pending:
+            wait = min(self._last + self.quiet, self._opened + self.max_delay) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        self._opened = None
+        lines = [describe(before, after) for before, after, describe in pending.values() if before != after]
+        if lines:
+            metrics.incr('updates_posted', len(lines))
+            await self.post(lines)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"Posting updates failed: {task.exception()}")
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import random
+import time
+from array import array
+
+import coc
+import numpy as np
+
+from fetcher import TokenBucket
+from metrics import metrics
+from prefetch import cwl_phase
+
+# Poll interval in seconds for each phase of the monthly CWL cycle
+DEFAULT_INTERVALS = {'signup': 900.0, 'war': 300.0, 'idle': 3600.0}
+
+# Stars assumed for accounts with few attacks: the average is pulled towards
+# PRIOR_STARS as if PRIOR_ATTACKS such attacks had been made
+PRIOR_STARS = 2.0
+PRIOR_ATTACKS = 3
+# Balance strength gained per star an account averages above PRIOR_STARS
+PERFORMANCE_WEIGHT = 0.25
+
+
+def war_adjusted(strength, average_stars):
+    return strength + PERFORMANCE_WEIGHT * (average_stars - PRIOR_STARS)
+
+
+class AttackLog:
+    """Every ingested war attack as parallel typed columns.
+
+    Account tags and seasons are interned to small integers, so one attack
+    costs a few bytes and per-account totals are a single bincount.
+    """
+
+    def __init__(self):
+        self.tags = []
+        self._tag_ids = {}
+        self.seasons = []
+        self._season_ids = {}
+        self.attacker = array('i')
+        self.season = array('h')
+        self.stars = array('b')
+        self.destruction = array('f')
+        self.th_diff = array('b')
+        self._keys = set()
+
+    def __len__(self):
+        return len(self.attacker)
+
+    def _intern(self, values, ids, value):
+        index = ids.get(value)
+        if index is None:
+            index = ids[value] = len(values)
+            values.append(value)
+        return index
+
+    def append(self, war_tag, season, attacker, order, stars, destruction, th_diff):
+        """Add one attack; returns False if (war, attacker, order) is already in the log."""
+        key = (war_tag, attacker, order)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self.attacker.append(self._intern(self.tags, self._tag_ids, attacker))
+        self.season.append(self._intern(self.seasons, self._season_ids, season))
+        self.stars.append(stars)
+        self.destruction.append(destruction)
+        self.th_diff.append(max(-127, min(127, th_diff)))
+        return True
+
+    def summary(self, seasons=None):
+        """`{tag: (attacks, stars, average destruction, three-star attacks)}`, optionally for the last `seasons` seasons."""
+        if not self.attacker:
+            return {}
+        attacker = np.frombuffer(self.attacker, dtype=np.int32)
+        stars = np.frombuffer(self.stars, dtype=np.int8).astype(float)
+        destruction = np.frombuffer(self.destruction, dtype=np.float32).astype(float)
+        if seasons is not None:
+            recent = {self._season_ids[season] for season in sorted(self.seasons)[-seasons:]}
+            keep = np.isin(np.frombuffer(self.season, dtype=np.int16), list(recent))
+            attacker, stars, destruction = attacker[keep], stars[keep], destruction[keep]
+        size = len(self.tags)
+        counts = np.bincount(attacker, minlength=size)
+        star_totals = np.bincount(attacker, weights=stars, minlength=size)
+        destruction_totals = np.bincount(attacker, weights=destruction, minlength=size)
+        triples = np.bincount(attacker, weights=stars == 3, minlength=size)
+        return {
+            self.tags[index]: (int(counts[index]), int(star_totals[index]), float(destruction_totals[index] / counts[index]), int(triples[index]))
+            for index in np.flatnonzero(counts)
+        }
+
+    def performance(self, seasons=None):
+        """`{tag: average stars}`, shrunk towards PRIOR_STARS for accounts with few attacks."""
+        return {
+            tag: (stars + PRIOR_STARS * PRIOR_ATTACKS) / (attacks + PRIOR_ATTACKS)
+            for tag, (attacks, stars, _, _) in self.summary(seasons).items()
+        }
+
+
+class WarTracker:
+    """Background task that follows the CWL group and round wars of the family clans.
+
+    Each round fetches the league group of every clan, then only the round wars
+    that can still change: wars known to be over, or known not to involve a
+    family clan, are never downloaded again, and nothing is re-fetched before
+    the API's Cache-Control says it could have changed. From each war only
+    attacks with a higher order than the last one ingested are appended to the
+    AttackLog and saved to the optional `store`. All calls draw on the
+    tracker's own token bucket.
+    """
+
+    def __init__(self, fetcher, clan_tags, store=None, rate=2.0, intervals=None, jitter=0.2):
+        self.fetcher = fetcher
+        self.clan_tags = clan_tags
+        self.store = store
+        self.budget = TokenBucket(rate)
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.jitter = jitter
+        self.log = AttackLog()
+        # war tag -> (state, last ingested order, involves a family clan)
+        self.wars = {}
+        self._not_before = {}
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+            logging.info("War tracker started")
+
+    def stop(self):
+        if self.running:
+            self._task.cancel()
+
+    async def load(self):
+        """Restore the attack log and war states saved by earlier runs."""
+        if not self.store:
+            return
+        attacks, wars = await self.store.get_war_history()
+        for row in attacks:
+            self.log.append(*row)
+        self.wars.update(wars)
+        logging.info(f"War history restored: {len(self.log)} attacks from {len(self.wars)} wars")
+
+    async def _run(self):
+        await self.load()
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.error(f"War poll failed: {e}")
+            interval = self.intervals[cwl_phase()]
+            await asyncio.sleep(interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _due(self, key):
+        return self._not_before.get(key, 0.0) <= time.time()
+
+    def _fetched(self, key, obj):
+        self._not_before[key] = time.time() + (getattr(obj, '_response_retry', None) or 0)
+
+    async def _get(self, key, fetch, tag):
+        await self.budget.acquire()
+        try:
+            obj = await fetch(tag)
+        except coc.errors.NotFound:
+            # Not in CWL this month; look again next round
+            return None
+        self._fetched(key, obj)
+        return obj
+
+    async def poll(self):
+        family = set(self.clan_tags())
+        new_attacks = []
+        polled = []
+        groups = 0
+        for clan_tag in family:
+            if not self._due(('group', clan_tag)):
+                continue
+            try:
+                group = await self._get(('group', clan_tag), self.fetcher.get_league_group, clan_tag)
+            except coc.errors.ClashOfClansException as e:
+                logging.warning(f"League group {clan_tag} failed: {e}")
+                continue
+            if group is None:
+                continue
+            groups += 1
+            for war_tag in (tag for round_tags in group.rounds for tag in round_tags):
+                state, last_order, ours = self.wars.get(war_tag, (None, 0, True))
+                if state == 'warEnded' or not ours or not self._due(('war', war_tag)):
+                    continue
+                try:
+                    war = await self._get(('war', war_tag), self.fetcher.get_league_war, war_tag)
+                except coc.errors.ClashOfClansException as e:
+                    logging.warning(f"League war {war_tag} failed: {e}")
+                    continue
+                if war is not None:
+                    new_attacks += self._ingest(war_tag, group.season, war, last_order, family)
+                    polled.append(war_tag)
+        if polled and self.store:
+            await self.store.put_war_history(new_attacks, {tag: self.wars[tag] for tag in polled})
+        metrics.incr('war_attacks_ingested', len(new_attacks))
+        logging.info(f"War poll: {groups} league groups, {len(new_attacks)} new attacks, {len(self.log)} attacks tracked")
+
+    def _ingest(self, war_tag, season, war, last_order, family):
+        ours = war.clan.tag in family or war.opponent.tag in family
+        rows = []
+        if ours:
+            town_halls = {member.tag: member.town_hall for member in war.members}
+            attackers = {member.tag for side in (war.clan, war.opponent) if side.tag in family for member in side.members}
+            for attack in war.attacks:
+                if attack.order <= last_order or attack.attacker_tag not in attackers:
+                    continue
+                row = (
+                    war_tag, season, attack.attacker_tag, attack.order, attack.stars, attack.destruction,
+                    town_halls.get(attack.defender_tag, 0) - town_halls.get(attack.attacker_tag, 0),
+                )
+                if self.log.append(*row):
+                    rows.append(row)
+            last_order = max([last_order] + [attack.order for attack in war.attacks])
+        self.wars[war_tag] = (war.state, last_order, ours)
+        return rows
@@ -0,0 +1,254 @@
+"""Worker processes for split mode.
+
+With BOT_WORKERS=N the bot process keeps the Discord gateway, interactions
+and the in-memory state commands answer from, and hands bulk jobs (clan
+reports, balancing, sheet sync) to N worker processes over Unix sockets.
+Each worker imports the bot module for its own caches, Sheets pool and CoC
+clients but never connects to Discord, so a heavy job only ever occupies a
+worker's event loop. Workers share the SQLite store with the gateway, which
+keeps their disk cache warm from the gateway's prefetching.
+
+A worker can also be run by hand: python worker.py /path/to/worker.sock
+"""
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+
+from metrics import metrics
+
+_HEADER = struct.Struct('!I')
+
+
+async def read_frame(reader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_frame(writer, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+def socket_paths(count, directory=None):
+    directory = directory or tempfile.gettempdir()
+    return [os.path.join(directory, f'cwl-worker-{os.getpid()}-{index}.sock') for index in range(count)]
+
+
+class WorkerError(Exception):
+    """A job raised inside the worker; carries the worker's error message."""
+
+
+class WorkerConnection:
+    """One socket to a worker, with requests multiplexed by id."""
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = self.writer = None
+        self.pending = {}
+        self._ids = itertools.count()
+        self._lock = asyncio.Lock()
+        self._reader_task = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def _connect(self):
+        async with self._lock:
+            if not self.connected:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self._reader_task = asyncio.ensure_future(self._read_replies(self.reader, self.writer))
+
+    async def _read_replies(self, reader, writer):
+        try:
+            while True:
+                request_id, ok, value = await read_frame(reader)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(WorkerError(value))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.warning(f"Worker {self.path} disconnected: {e}")
+        finally:
+            writer.close()
+            if self.writer is writer:
+                self.writer = None
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Worker {self.path} disconnected"))
+
+    async def call(self, name, args, timeout):
+        await self._connect()
+        request_id = next(self._ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        try:
+            write_frame(self.writer, (request_id, name, args))
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+
+class WorkerPool:
+    """Gateway side of split mode: routes jobs to worker sockets.
+
+    Jobs with the same key (the guild) always go to the same worker, so that
+    guild's token bucket and cached data live in one place. Jobs without a
+    key go to the worker with the fewest requests in flight. A worker that
+    cannot be reached raises ConnectionError, which lets the caller fall back
+    to running the job itself.
+    """
+
+    def __init__(self, paths, timeout=120.0):
+        self.connections = [WorkerConnection(path) for path in paths]
+        self.timeout = timeout
+        self.processes = []
+
+    def __len__(self):
+        return len(self.connections)
+
+    @property
+    def stats(self):
+        return {
+            'connected': sum(connection.connected for connection in self.connections),
+            'pending': sum(len(connection.pending) for connection in self.connections),
+            'alive': sum(process.poll() is None for process in self.processes),
+        }
+
+    def _route(self, key):
+        if key is None:
+            return min(self.connections, key=lambda connection: len(connection.pending))
+        return self.connections[zlib.crc32(str(key).encode()) % len(self.connections)]
+
+    async def call(self, name, *args, key=None):
+        connection = self._route(key)
+        with metrics.span('worker_call_seconds', job=name):
+            try:
+                return await connection.call(name, args, self.timeout)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise ConnectionError(f"Worker {connection.path} is not running") from e
+
+    def spawn(self):
+        """Start one local worker process per socket.
+
+        Workers run this file as a script rather than through multiprocessing,
+        so the bot module is imported once per worker, after `run` has pointed
+        logging and metrics at the worker's own files.
+        """
+        for index, connection in enumerate(self.connections):
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), connection.path, str(index)])
+            self.processes.append(process)
+        logging.info(f"Started {len(self.processes)} worker processes")
+
+    async def close(self):
+        for connection in self.connections:
+            if connection.connected:
+                connection.writer.close()
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        await asyncio.gather(*(asyncio.to_thread(_reap, process) for process in self.processes))
+        self.processes.clear()
+        for connection in self.connections:
+            if os.path.exists(connection.path):
+                os.unlink(connection.path)
+
+
+def _reap(process, timeout=5):
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def _run_job(writer, jobs, request_id, name, args):
+    try:
+        if name not in jobs:
+            raise ValueError(f"Unknown job {name}")
+        result = await jobs[name](*args)
+        write_frame(writer, (request_id, True, result))
+    except Exception as e:
+        logging.exception(f"Worker job {name} failed")
+        write_frame(writer, (request_id, False, str(e) or type(e).__name__))
+    await writer.drain()
+
+
+async def serve(path, jobs):
+    """Answer `(request_id, job name, args)` frames on a Unix socket with `jobs[name](*args)`."""
+
+    async def handle(reader, writer):
+        tasks = set()
+        try:
+            while True:
+                request_id, name, args = await read_frame(reader)
+                task = asyncio.ensure_future(_run_job(writer, jobs, request_id, name, args))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path)
+    # Frames are pickles, so only this user may connect
+    os.chmod(path, 0o600)
+    return server
+
+
+def _per_worker(name, default, index):
+    # Each worker writes its own log and metrics files next to the gateway's
+    path = os.getenv(name, default)
+    if path:
+        base, ext = os.path.splitext(path)
+        os.environ[name] = f'{base}.worker{index}{ext}'
+
+
+def run(path, index=0):
+    """Entry point of one worker process."""
+    _per_worker('LOG_FILE', 'discord.log', index)
+    _per_worker('LOG_JSON_FILE', 'events.jsonl', index)
+    _per_worker('METRICS_FILE', 'metrics.prom', index)
+    os.environ['BOT_WORKERS'] = '0'
+    asyncio.run(_main(path))
+
+
+async def _main(path):
+    import coctest
+
+    coctest.start_subsystems(background_tasks=False)
+    await coctest.guilds.load()
+    server = await serve(path, coctest.WORKER_JOBS)
+    metrics_task = asyncio.ensure_future(coctest.export_metrics())
+    # The gateway stops workers with SIGTERM; shut down cleanly instead of dying mid-write
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    logging.info(f"Worker {os.getpid()} serving {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        metrics_task.cancel()
+        await coctest.shutdown()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)